@@ -2,16 +2,24 @@
 Main Streamlit application for the SQLite AI Chatbot.
 """
 import os
-import time
+import uuid
+import logging
+import weakref
+import asyncio
+import shutil
+import hashlib
+import threading
 import streamlit as st
 import pandas as pd
 import config
-from typing import Dict, List, Tuple, Any
+from typing import Dict, List, Tuple, Any, AsyncIterator, Iterator
 
 # Import local modules
 from database import DatabaseConnector, SchemaExtractor
-from llm import GeminiAPI, PromptBuilder
-from utils import QueryProcessor, ResponseFormatter
+from llm import GeminiAPI, PromptBuilder, ResponseCache, PersistentCache
+from utils import QueryProcessor, answer_metadata_query, parse_llm_response
+
+logger = logging.getLogger(__name__)
 
 # Set page configuration
 st.set_page_config(
@@ -89,15 +97,180 @@ if "schema_info" not in st.session_state:
 if "temp_file_path" not in st.session_state:
     st.session_state.temp_file_path = None
 
+if "db_hash" not in st.session_state:
+    st.session_state.db_hash = None
+
 if "db_connector" not in st.session_state:
     st.session_state.db_connector = None
 
+if "db_cleanup" not in st.session_state:
+    st.session_state.db_cleanup = None
+
 if "llm_api" not in st.session_state:
     st.session_state.llm_api = GeminiAPI()
 
 if "processing_query" not in st.session_state:
     st.session_state.processing_query = False
 
+if "cancel_event" not in st.session_state:
+    st.session_state.cancel_event = None
+
+if "page_cursors" not in st.session_state:
+    st.session_state.page_cursors = {}
+
+
+def _remove_database_files(db_path: str) -> None:
+    """
+    Delete a session's database copy along with its WAL and shared-memory files.
+    
+    Args:
+        db_path: Path to the database file on disk
+    """
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not remove temporary database file %s: %s", path, e)
+
+
+@st.cache_data(show_spinner=False)
+def _get_schema(db_hash: str, _db_connector: DatabaseConnector) -> str:
+    """
+    Get the prompt schema for an uploaded database.
+    
+    Extracted right after upload, so every copy of the same content has the same schema.
+    
+    Args:
+        db_hash: Content hash of the uploaded database file (cache key)
+        _db_connector: Connector for this session's copy of the database (not hashed)
+        
+    Returns:
+        Schema formatted for the LLM prompt
+    """
+    return SchemaExtractor(_db_connector).get_schema_for_prompt()
+
+
+@st.cache_data(show_spinner=False)
+def _get_schema_summary(db_hash: str, signature: Tuple, _db_connector: DatabaseConnector) -> str:
+    """
+    Get the human-readable schema summary for a database.
+    
+    Args:
+        db_hash: Content hash of the uploaded database file (cache key)
+        signature: File signature of the session's copy, so changes made by
+                   queries produce a fresh summary (cache key)
+        _db_connector: Connector for this session's copy of the database (not hashed)
+        
+    Returns:
+        Formatted schema summary
+    """
+    return SchemaExtractor(_db_connector).get_schema_summary()
+
+
+@st.cache_resource(show_spinner=False)
+def _get_prompt_builder(schema_info: str) -> PromptBuilder:
+    """
+    Get the prompt builder for a database schema.
+    
+    Args:
+        schema_info: Schema formatted for the LLM prompt
+        
+    Returns:
+        Cached PromptBuilder instance
+    """
+    return PromptBuilder(schema_info)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_embedding_model():
+    """Load the sentence embedding model, or None if sentence-transformers is not installed."""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        logger.info("sentence-transformers not installed, semantic response cache disabled")
+        return None
+    return SentenceTransformer(config.EMBEDDING_MODEL_NAME)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_response_cache() -> ResponseCache:
+    """Get the LLM response cache shared across sessions."""
+    model = _get_embedding_model()
+    return ResponseCache(
+        embed=model.encode if model is not None else None,
+        similarity_threshold=config.CACHE_SIMILARITY_THRESHOLD,
+        max_entries=config.RESPONSE_CACHE_MAX_ENTRIES
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """Start the background event loop shared by all sessions for LLM requests."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True).start()
+    return loop
+
+
+@st.cache_resource(show_spinner=False)
+def _get_persistent_cache() -> PersistentCache:
+    """Get the on-disk LLM response cache shared across sessions."""
+    return PersistentCache(config.RESPONSE_CACHE_PATH, max_age=config.RESPONSE_CACHE_MAX_AGE)
+
+
+def iterate_on_event_loop(async_iterator: AsyncIterator[str]) -> Iterator[str]:
+    """
+    Consume an async iterator on the shared event loop from the script thread.
+    
+    Args:
+        async_iterator: Async generator to run on the shared event loop
+        
+    Yields:
+        Items produced by the async iterator
+    """
+    loop = _get_event_loop()
+    
+    async def next_item():
+        return await async_iterator.__anext__()
+    
+    async def close():
+        await async_iterator.aclose()
+    
+    try:
+        while True:
+            try:
+                item = asyncio.run_coroutine_threadsafe(next_item(), loop).result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        # Closes the underlying HTTP response if the script stops mid-stream
+        asyncio.run_coroutine_threadsafe(close(), loop)
+
+
+def cancel_llm_request() -> None:
+    """Signal the in-flight async LLM request of this session to stop."""
+    cancel_event = st.session_state.cancel_event
+    if cancel_event is not None:
+        _get_event_loop().call_soon_threadsafe(cancel_event.set)
+        st.session_state.cancel_event = None
+
+
+def get_db_connector() -> DatabaseConnector:
+    """Get the connector for the current session's database, if connected."""
+    return st.session_state.db_connector
+
+
+def close_db_connection() -> None:
+    """Close the session's database connection and delete its temporary copy."""
+    if st.session_state.db_connector is not None:
+        st.session_state.db_connector.disconnect()
+    if st.session_state.db_cleanup is not None:
+        st.session_state.db_cleanup()
+    st.session_state.db_connector = None
+    st.session_state.db_cleanup = None
+
 
 def initialize_db_connection(db_file) -> Tuple[bool, str]:
     """
@@ -112,47 +285,160 @@ def initialize_db_connection(db_file) -> Tuple[bool, str]:
         - Error message if connection failed
     """
     try:
-        # Create a temporary file to store the uploaded DB
+        # Hash the uploaded content so re-uploads of the same file share the cached schema
+        db_hash = hashlib.blake2b(db_file.getbuffer(), digest_size=16).hexdigest()
+        
+        # Create a temporary file to store the uploaded DB. Queries may write to it,
+        # so every session gets its own copy
         temp_dir = "temp"
         os.makedirs(temp_dir, exist_ok=True)
+        temp_file_path = os.path.join(temp_dir, f"db_{db_hash}_{uuid.uuid4().hex}.db")
         
-        # Generate a unique filename
-        timestamp = int(time.time())
-        temp_file_path = os.path.join(temp_dir, f"db_{timestamp}.db")
+        # Stream in 1MB chunks to a partial file, then move it into place so a
+        # half-written database is never picked up
+        partial_path = f"{temp_file_path}.tmp"
+        db_file.seek(0)
+        with open(partial_path, "wb") as f:
+            shutil.copyfileobj(db_file, f, 1 << 20)
+        os.replace(partial_path, temp_file_path)
         
-        # Save the uploaded file
-        with open(temp_file_path, "wb") as f:
-            f.write(db_file.getbuffer())
+        # Test the connection. The copy is deleted on disconnect, or once the
+        # session (and with it the connector) is garbage collected
+        try:
+            db_connector = DatabaseConnector(temp_file_path)
+        except Exception:
+            _remove_database_files(temp_file_path)
+            raise
+        close_db_connection()
+        st.session_state.db_connector = db_connector
+        st.session_state.db_cleanup = weakref.finalize(db_connector, _remove_database_files, temp_file_path)
         
-        # Store the file path in session state
+        # Store the file path and hash in session state
         st.session_state.temp_file_path = temp_file_path
+        st.session_state.db_hash = db_hash
         
-        # Test the connection
-        db_connector = DatabaseConnector(temp_file_path)
-        st.session_state.db_connector = db_connector
-        
-        # Extract schema information
-        schema_extractor = SchemaExtractor(db_connector)
-        schema_info = schema_extractor.get_schema_for_prompt()
-        st.session_state.schema_info = schema_info
+        # Extract schema information (cached per file hash)
+        st.session_state.schema_info = _get_schema(db_hash, db_connector)
         
         return True, "Database connection successful"
     
     except Exception as e:
+        close_db_connection()
+        st.session_state.db_hash = None
         return False, f"Error connecting to database: {str(e)}"
 
 
 def execute_sql_directly(query: str):
-    """Execute an SQL query directly and return results."""
-    if not st.session_state.db_connector:
-        return None, "No database connection"
+    """Execute an SQL query directly and return results and whether they were truncated."""
+    db_connector = get_db_connector()
+    if not db_connector:
+        return None, "No database connection", False
     
     try:
         # Execute the query
-        df, error, _ = st.session_state.db_connector.execute_query(query)
-        return df, error
+        result = db_connector.execute_query(query)
+        return result.df, result.error, result.truncated
     except Exception as e:
-        return None, str(e)
+        return None, str(e), False
+
+
+def load_next_page(message: Dict[str, Any]) -> None:
+    """
+    Replace a chat message's truncated query results with the next page of rows.
+    
+    Queries ending in ORDER BY a column the schema guarantees is unique are paged
+    on that column (WHERE key > last key), so each page costs the same however deep
+    it is. Other queries, where rows could tie on the key, keep an open cursor in
+    session state and fetch the next chunk from it.
+    
+    Args:
+        message: Assistant chat message holding sql_query and query_results
+    """
+    db_connector = get_db_connector()
+    if not db_connector:
+        return
+    
+    sql_query = message["sql_query"]
+    page_size = config.MAX_RESULT_ROWS
+    query_hash = hashlib.blake2b(
+        f"{st.session_state.db_hash}\0{sql_query}".encode("utf-8"), digest_size=16
+    ).hexdigest()
+    
+    cursor = st.session_state.page_cursors.get(query_hash)
+    if cursor is None or not message.get("results_page"):
+        # Start from the page the message is already showing
+        results_df = message["query_results"]
+        order_col = db_connector.get_keyset_column(sql_query)
+        if order_col in results_df.columns and not pd.isna(results_df[order_col].iloc[-1]):
+            cursor = {"order_col": order_col, "last_key": results_df[order_col].iloc[-1]}
+        else:
+            rows = db_connector.iter_query(sql_query, chunk_size=page_size)
+            next(rows)  # Skip the page that is already displayed
+            cursor = {"rows": rows}
+        st.session_state.page_cursors[query_hash] = cursor
+    
+    if "rows" in cursor:
+        try:
+            page = next(cursor["rows"], None)
+        except Exception as e:
+            logger.debug("Error fetching next page: %s", e)
+            page = None
+        has_more = page is not None and len(page) == page_size
+    else:
+        page, error, _, cursor["last_key"], has_more = db_connector.execute_query_paginated(
+            sql_query, cursor["order_col"], cursor["last_key"], limit=page_size
+        )
+        if error:
+            logger.debug("Error fetching next page: %s", error)
+            page = None
+    
+    if page is not None and not page.empty:
+        message["query_results"] = page
+        message["results_page"] = message.get("results_page", 0) + 1
+    message["results_truncated"] = has_more
+    if not has_more:
+        st.session_state.page_cursors.pop(query_hash, None)
+
+
+def format_chat_history(
+    prompt_builder: PromptBuilder,
+    chat_history: List[Dict[str, Any]],
+    query: str
+) -> List[Dict[str, str]]:
+    """
+    Convert the most recent chat turns into LLM messages.
+    
+    Only the last MAX_HISTORY_LENGTH turns are considered, and a question that
+    was asked more than once is only kept at its latest occurrence.
+    
+    Args:
+        prompt_builder: Prompt builder for the connected database
+        chat_history: Session chat history, possibly ending with the current query
+        query: User's current natural language query
+        
+    Returns:
+        List of user/assistant message dictionaries
+    """
+    # The current query is sent separately by build_messages
+    if chat_history and chat_history[-1]["role"] == "user" and chat_history[-1]["content"] == query:
+        chat_history = chat_history[:-1]
+    recent = chat_history[-2 * config.MAX_HISTORY_LENGTH:]
+    
+    # Position of the latest occurrence of each question (the current query counts as latest)
+    latest = {msg["content"]: i for i, msg in enumerate(recent) if msg["role"] == "user"}
+    latest[query] = len(recent)
+    
+    formatted_history = []
+    skip_turn = False
+    for i, msg in enumerate(recent):
+        if msg["role"] == "user":
+            skip_turn = latest[msg["content"]] != i
+            if not skip_turn:
+                formatted_history.append(prompt_builder.build_user_message(msg["content"]))
+        elif msg["role"] == "assistant" and "raw_content" in msg and not skip_turn:
+            formatted_history.append(prompt_builder.build_assistant_message(msg["raw_content"]))
+    
+    return formatted_history
 
 
 def process_user_query(query: str) -> Dict[str, Any]:
@@ -169,51 +455,79 @@ def process_user_query(query: str) -> Dict[str, Any]:
         # Set processing flag
         st.session_state.processing_query = True
         
-        # Initialize LLM components
-        llm_api = st.session_state.llm_api
-        prompt_builder = PromptBuilder(st.session_state.schema_info)
+        # Questions like "list all tables" are answered straight from the database
+        db_connector = get_db_connector()
+        metadata_answer = answer_metadata_query(query, db_connector) if db_connector else None
+        if metadata_answer is not None:
+            logger.debug("Answered metadata query without the LLM")
+            st.session_state.processing_query = False
+            return dict(metadata_answer, success=True)
         
-        # Convert chat history to format expected by LLM
-        formatted_history = []
-        for msg in st.session_state.chat_history:
-            if msg["role"] == "user":
-                formatted_history.append(prompt_builder.build_user_message(msg["content"]))
-            elif msg["role"] == "assistant" and "raw_content" in msg:
-                formatted_history.append(prompt_builder.build_assistant_message(msg["raw_content"]))
+        # Reuse the LLM answer to the same (or a very similar) question. Only the
+        # answer is cached; its SQL runs again so the results reflect the database now
+        response_cache = _get_response_cache()
+        cached = response_cache.get(st.session_state.db_hash, query)
+        if cached is not None:
+            logger.debug("Response cache hit")
         
-        # Build messages with conversation history
-        messages = prompt_builder.build_messages(query, formatted_history)
+        # Initialize LLM components
+        llm_api = st.session_state.llm_api
         
-        # Generate response from LLM with extended timeout
-        try:
-            with st.spinner("Thinking... (this might take a while for complex queries)"):
-                response = llm_api.generate_response(
-                    messages, 
-                    temperature=0.2,  # Lower temperature for more deterministic SQL generation
-                    max_tokens=2048,  # Increased token limit for complex queries
-                    timeout=300  # 5 minutes timeout
-                )
-        except Exception as e:
-            print(f"LLM response generation error: {str(e)}")
-            st.session_state.processing_query = False
-            return {
-                "success": False,
-                "error": "LLM request timed out. Try a simpler query or break this into smaller steps."
-            }
+        # Fall back to a response persisted by an earlier run before calling the LLM
+        persistent_cache = _get_persistent_cache()
+        cache_key = ResponseCache.make_key(st.session_state.db_hash, query)
+        response = cached["llm_response"] if cached is not None else persistent_cache.get(cache_key)
         
-        if response:
-            # Parse LLM response
-            parsed_response = ResponseFormatter.parse_llm_response(response)
+        if response is None:
+            prompt_builder = _get_prompt_builder(st.session_state.schema_info)
+            
+            # Convert chat history to format expected by LLM
+            formatted_history = format_chat_history(prompt_builder, st.session_state.chat_history, query)
             
-            # Extract SQL query from response
-            sql_query = llm_api.extract_sql_from_response(response)
+            # Build messages with conversation history
+            messages = prompt_builder.build_messages(query, formatted_history)
+            
+            # Generate response from LLM with extended timeout
+            try:
+                # Stream tokens into the page as they arrive; the request runs on the
+                # shared event loop so it can be cancelled
+                cancel_event = asyncio.Event()
+                st.session_state.cancel_event = cancel_event
+                response = st.write_stream(iterate_on_event_loop(
+                    llm_api.astream_response(
+                        messages, 
+                        temperature=0.2,  # Lower temperature for more deterministic SQL generation
+                        max_tokens=2048,  # Increased token limit for complex queries
+                        timeout=300,  # 5 minutes timeout
+                        cancel_event=cancel_event
+                    )
+                ))
+                st.session_state.cancel_event = None
+            except Exception as e:
+                logger.error("LLM response generation error: %s", e)
+                st.session_state.processing_query = False
+                return {
+                    "success": False,
+                    "error": "LLM request timed out. Try a simpler query or break this into smaller steps."
+                }
+            
+        if response:
+            if cached is not None:
+                parsed_response = cached["parsed_response"]
+                sql_query = cached["sql_query"]
+            else:
+                # Parse LLM response
+                parsed_response = parse_llm_response(response)
+                
+                # Extract SQL query from response
+                sql_query = llm_api.extract_sql_from_response(response)
             
             # If SQL query was extracted, execute it
             if sql_query:
-                print(f"Extracted SQL query: {sql_query}")
+                logger.debug("Extracted SQL query: %s", sql_query)
                 
                 # Execute the query directly
-                results_df, error = execute_sql_directly(sql_query)
+                results_df, error, truncated = execute_sql_directly(sql_query)
                 
                 if error:
                     st.session_state.processing_query = False
@@ -225,12 +539,25 @@ def process_user_query(query: str) -> Dict[str, Any]:
                         "sql_query": sql_query
                     }
                 
+                if cached is None:
+                    persistent_cache.put(cache_key, response)
+                    # Only answers with read queries are kept in memory: the semantic
+                    # tier could otherwise match a differently worded write, such as
+                    # deleting another row
+                    if QueryProcessor(db_connector).is_read_query(sql_query):
+                        response_cache.put(st.session_state.db_hash, query, {
+                            "llm_response": response,
+                            "parsed_response": parsed_response,
+                            "sql_query": sql_query
+                        })
+                
                 st.session_state.processing_query = False
                 return {
                     "success": True,
                     "llm_response": response,
                     "parsed_response": parsed_response,
                     "query_results": results_df,
+                    "results_truncated": truncated,
                     "sql_query": sql_query
                 }
             else:
@@ -249,7 +576,7 @@ def process_user_query(query: str) -> Dict[str, Any]:
             }
     
     except Exception as e:
-        print(f"Error in process_user_query: {str(e)}")
+        logger.exception("Error in process_user_query: %s", e)
         st.session_state.processing_query = False
         return {
             "success": False,
@@ -289,9 +616,11 @@ def main():
             
             # Display schema information
             if st.button("View Database Schema"):
-                # Get and format schema for display
-                schema_extractor = SchemaExtractor(st.session_state.db_connector)
-                schema_summary = schema_extractor.get_schema_summary()
+                # Get and format schema for display (cached per database file)
+                db_connector = get_db_connector()
+                schema_summary = _get_schema_summary(
+                    st.session_state.db_hash, db_connector.file_signature(), db_connector
+                )
                 
                 with st.expander("Database Schema", expanded=True):
                     st.text(schema_summary)
@@ -299,6 +628,7 @@ def main():
             # Add reset button for LLM
             if st.button("Reset LLM State"):
                 # Cancel any current LLM request
+                cancel_llm_request()
                 if st.session_state.llm_api:
                     st.session_state.llm_api.cancel_current_request()
                 
@@ -313,26 +643,21 @@ def main():
             # Option to disconnect
             if st.button("Disconnect Database"):
                 # Cancel any pending LLM requests
+                cancel_llm_request()
                 if st.session_state.llm_api:
                     st.session_state.llm_api.cancel_current_request()
                 
-                if st.session_state.db_connector:
-                    st.session_state.db_connector.disconnect()
-                
-                # Clean up the temporary file if it exists
-                if st.session_state.temp_file_path and os.path.exists(st.session_state.temp_file_path):
-                    try:
-                        os.remove(st.session_state.temp_file_path)
-                    except OSError:
-                        pass
+                # Close the connection and delete this session's copy of the database
+                close_db_connection()
                 
                 # Reset session state
                 st.session_state.db_connected = False
                 st.session_state.schema_info = None
                 st.session_state.chat_history = []
                 st.session_state.temp_file_path = None
-                st.session_state.db_connector = None
+                st.session_state.db_hash = None
                 st.session_state.processing_query = False
+                st.session_state.page_cursors = {}
                 st.session_state.llm_api = GeminiAPI()
                 
                 st.success("Database disconnected!")
@@ -344,7 +669,7 @@ def main():
         st.markdown("<h2 class='subheader'>Chat with Your Database</h2>", unsafe_allow_html=True)
         
         # Display chat history
-        for message in st.session_state.chat_history:
+        for index, message in enumerate(st.session_state.chat_history):
             if message["role"] == "user":
                 st.markdown(f"<div class='chat-message user-message'><strong>You:</strong> {message['content']}</div>", unsafe_allow_html=True)
             else:
@@ -371,7 +696,18 @@ def main():
                     
                     # Show the number of rows
                     row_count = len(message["query_results"])
-                    st.markdown(f"<div class='info-text'>{row_count} row(s) returned</div>", unsafe_allow_html=True)
+                    page = message.get("results_page", 0)
+                    if page:
+                        st.markdown(f"<div class='info-text'>Page {page + 1}: {row_count} row(s)</div>", unsafe_allow_html=True)
+                    elif message.get("results_truncated"):
+                        st.markdown(f"<div class='info-text'>Showing the first {row_count} row(s)</div>", unsafe_allow_html=True)
+                    else:
+                        st.markdown(f"<div class='info-text'>{row_count} row(s) returned</div>", unsafe_allow_html=True)
+                    
+                    if message.get("results_truncated") and sql_query:
+                        if st.button("Next page", key=f"next_page_{index}"):
+                            load_next_page(message)
+                            st.rerun()
         
         # Show processing indicator
         if st.session_state.processing_query:
@@ -417,6 +753,7 @@ def main():
                     # Add query results if available
                     if "query_results" in response_data:
                         assistant_message["query_results"] = response_data["query_results"]
+                        assistant_message["results_truncated"] = response_data.get("results_truncated", False)
                     
                     st.session_state.chat_history.append(assistant_message)
                 else:
@@ -35,8 +35,18 @@ if not API_KEYS:
     ]
 
 LLM_MODEL_NAME = "google/gemini-2.5-pro-exp-03-25:free"  # Gemini 2.5 Pro model
+HEDGED_REQUEST_KEYS = 2  # API keys raced in parallel before falling back to the rest one at a time
+KEY_COOLDOWN_SECONDS = 5  # Cooldown after a key's first failed request, doubling with each further failure
+KEY_COOLDOWN_MAX_SECONDS = 300  # Upper bound on a key's cooldown
 
 # Application settings
 MAX_HISTORY_LENGTH = 10  # Max number of conversation turns to keep
 MAX_SAMPLE_ROWS = 5  # Number of sample rows to include per table
-MAX_RESULT_ROWS = 100  # Max number of rows to display in results
\ No newline at end of file
+MAX_RESULT_ROWS = 100  # Max number of rows to display in results
+# Response cache settings
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"  # Used for semantic cache lookups
+CACHE_SIMILARITY_THRESHOLD = 0.92  # Min cosine similarity to reuse a cached response
+RESPONSE_CACHE_MAX_ENTRIES = 256  # In-memory responses kept before evicting the least recently used
+RESULT_CACHE_MAX_ENTRIES = 128  # Read query results kept by the Gradio app
+RESPONSE_CACHE_PATH = os.path.join("temp", "response_cache.db")  # Persists LLM responses across restarts
+RESPONSE_CACHE_MAX_AGE = 7 * 24 * 60 * 60  # Seconds before a persisted response is evicted
\ No newline at end of file
@@ -1,7 +1,7 @@
 """
 Database module initialization.
 """
-from .connector import DatabaseConnector
+from .connector import DatabaseConnector, QueryResult
 from .schema import SchemaExtractor
 
-__all__ = ["DatabaseConnector", "SchemaExtractor"]
\ No newline at end of file
+__all__ = ["DatabaseConnector", "QueryResult", "SchemaExtractor"]
\ No newline at end of file
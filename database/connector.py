@@ -1,11 +1,169 @@
 """
 Database connection and query execution module.
 """
+import os
 import sqlite3
 import pandas as pd
-from typing import List, Dict, Tuple, Optional, Union
+from typing import List, Dict, Tuple, Optional, Union, Iterator
+import logging
 import threading
 import re
+from contextlib import contextmanager
+from functools import lru_cache, cached_property
+from config import MAX_RESULT_ROWS
+
+logger = logging.getLogger(__name__)
+
+# String literals, quoted identifiers, comments and statement separators, matched in one pass
+_SQL_TOKEN_RE = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/|;""", re.DOTALL)
+
+# A trailing "ORDER BY <column> [ASC]" on a single unqualified column, usable as a keyset cursor
+_ORDER_BY_TAIL_RE = re.compile(
+    r"""\bORDER\s+BY\s+("(?:[^"]|"")*"|[A-Za-z_]\w*)(?:\s+ASC)?\s*;?\s*$""", re.IGNORECASE
+)
+
+# A plain SELECT of columns from one table, optionally filtered, ending in ORDER BY: the
+# only shape where a result column's uniqueness can be read from the table's schema
+_IDENT = r"""(?:"(?:[^"]|"")*"|[A-Za-z_]\w*)"""
+_KEYSET_SOURCE_RE = re.compile(
+    rf"""^SELECT\s+(?:\*|(?:{_IDENT}\.)?{_IDENT}(?:\s*,\s*(?:{_IDENT}\.)?{_IDENT})*)"""
+    rf"""\s+FROM\s+({_IDENT})(?:\s+(?:AS\s+)?[A-Za-z_]\w*)?"""
+    r"""\s+(?:WHERE\b(?:(?!\bGROUP\s+BY\b|\bHAVING\b|\bUNION\b|\bINTERSECT\b|\bEXCEPT\b).)*?\s+)?ORDER\s+BY\b""",
+    re.IGNORECASE | re.DOTALL
+)
+
+
+# Applied once per connection: WAL lets readers proceed alongside a writer, and the
+# larger page cache plus memory-mapped I/O speed up big SELECTs. The mapping reads
+# straight from the OS page cache, so app workers opening the same file share it
+_CONNECTION_PRAGMAS = """
+PRAGMA foreign_keys = ON;
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA mmap_size = 1073741824;
+PRAGMA cache_size = -65536;
+PRAGMA temp_store = MEMORY;
+"""
+
+
+def _quote_ident(name: str) -> str:
+    """Quote an SQL identifier such as a table name."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _unquote_ident(name: str) -> str:
+    """Remove the double quotes around an SQL identifier, if any."""
+    if name.startswith('"'):
+        return name[1:-1].replace('""', '"')
+    return name
+
+
+def _column_from_row(row: Tuple) -> Dict:
+    """Convert a pragma_table_info row into a column dictionary."""
+    return {
+        "cid": row[0],
+        "name": row[1],
+        "type": row[2],
+        "notnull": row[3],
+        "default_value": row[4],
+        "is_primary_key": row[5] == 1
+    }
+
+
+def _foreign_key_from_row(row: Tuple) -> Dict:
+    """Convert a pragma_foreign_key_list row into a foreign key dictionary."""
+    return {
+        "id": row[0],
+        "seq": row[1],
+        "table": row[2],
+        "from": row[3],
+        "to": row[4],
+        "on_update": row[5],
+        "on_delete": row[6],
+        "match": row[7]
+    }
+
+
+@lru_cache(maxsize=256)
+def _first_statement(query: str) -> Tuple[str, bool]:
+    """
+    Remove comments from an SQL string and isolate its first statement.
+    
+    Semicolons and comment markers inside quoted strings are left untouched.
+    
+    Args:
+        query: Raw SQL text, possibly containing several statements
+        
+    Returns:
+        Tuple containing:
+        - The first statement without comments (terminated by ';' if one was present)
+        - Whether further statements follow the first one
+    """
+    parts = []
+    pos = 0
+    statement = None
+    
+    for match in _SQL_TOKEN_RE.finditer(query):
+        token = match.group()
+        if statement is not None:
+            # Past the first statement: any code outside comments starts another one
+            if query[pos:match.start()].strip() or token[0] in "'\"":
+                return statement, True
+        elif token == ";":
+            parts.append(query[pos:match.start()])
+            statement = "".join(parts).strip() + ";"
+        elif token.startswith(("--", "/*")):
+            parts.append(query[pos:match.start()])
+        else:
+            continue
+        pos = match.end()
+    
+    if statement is not None:
+        return statement, bool(query[pos:].strip())
+    
+    parts.append(query[pos:])
+    return "".join(parts).strip(), False
+
+
+class QueryResult:
+    """Result of executing an SQL query."""
+    
+    def __init__(
+        self,
+        df_or_none: Optional[pd.DataFrame] = None,
+        message: Optional[str] = None,
+        rowcount: int = -1,
+        error: Optional[str] = None,
+        elapsed: float = 0.0,
+        truncated: bool = False
+    ):
+        """
+        Initialize the query result.
+        
+        Args:
+            df_or_none: Result rows for queries that return them
+            message: Summary for statements that don't return rows (INSERT, UPDATE, etc.)
+            rowcount: Number of rows affected by a non-SELECT statement
+            error: Error message (if any)
+            elapsed: Execution time in seconds
+            truncated: Whether the results were truncated to MAX_RESULT_ROWS
+        """
+        self.df_or_none = df_or_none
+        self.message = message
+        self.rowcount = rowcount
+        self.error = error
+        self.elapsed = elapsed
+        self.truncated = truncated
+    
+    @cached_property
+    def df(self) -> pd.DataFrame:
+        """Result rows as a DataFrame; a one-row frame holding the message for writes."""
+        if self.df_or_none is not None:
+            return self.df_or_none
+        if self.message is not None:
+            return pd.DataFrame([{"message": self.message}])
+        return pd.DataFrame()
+
 
 class DatabaseConnector:
     """Handles SQLite database connections and query execution."""
@@ -18,73 +176,119 @@ class DatabaseConnector:
             db_path: Path to the SQLite database file
         """
         self.db_path = db_path
-        self._local = threading.local()
-        self._local.conn = None
+        self._conn = None
+        self._connect_lock = threading.Lock()
+        # Reentrant so queries can run inside transaction()
+        self._write_lock = threading.RLock()
         self.connect()
     
     def connect(self) -> None:
         """Establish connection to the SQLite database."""
         try:
-            self._local.conn = sqlite3.connect(self.db_path)
-            # Enable foreign key constraints
-            self._local.conn.execute("PRAGMA foreign_keys = ON")
-            print(f"Connected to database at {self.db_path}")
+            # One connection is shared by all threads; autocommit mode so reads
+            # never hold a transaction open
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            # Enable foreign key constraints and tune for concurrent reads
+            conn.executescript(_CONNECTION_PRAGMAS)
+            self._conn = conn
+            logger.info("Connected to database at %s", self.db_path)
         except sqlite3.Error as e:
-            print(f"Database connection error: {str(e)}")
+            logger.error("Database connection error: %s", e)
             raise Exception(f"Database connection error: {str(e)}")
     
     def disconnect(self) -> None:
         """Close the database connection if it exists."""
-        if hasattr(self._local, 'conn') and self._local.conn:
-            self._local.conn.close()
-            self._local.conn = None
+        with self._connect_lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+    
+    def file_signature(self) -> Tuple:
+        """
+        Get a signature that changes whenever the database is modified.
+        
+        Returns:
+            Modification time and size of the database file and its WAL file
+            (None for a file that doesn't exist)
+        """
+        signature = []
+        # In WAL mode writes land in the -wal file until a checkpoint
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+    
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Run the queries issued inside the block in a single transaction.
+        
+        The transaction takes SQLite's locks and read snapshot once and commits
+        once for all statements. Other threads' writes wait until it ends. If the
+        block raises, the transaction is rolled back and the exception propagates.
+        """
+        with self._write_lock:
+            self.conn.execute("BEGIN")
+            try:
+                yield
+            except BaseException:
+                # SQLite may have rolled back already (e.g. on a full disk)
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                raise
+            else:
+                self.conn.execute("COMMIT")
     
     @property
     def conn(self):
-        """Get the thread-local connection, creating it if necessary."""
-        if not hasattr(self._local, 'conn') or self._local.conn is None:
-            self.connect()
-        return self._local.conn
+        """Get the shared connection, creating it if necessary."""
+        if self._conn is None:
+            with self._connect_lock:
+                if self._conn is None:
+                    self.connect()
+        return self._conn
     
-    def execute_query(self, query: str) -> Tuple[pd.DataFrame, Optional[str], float]:
+    def execute_query(self, query: str) -> QueryResult:
         """
-        Execute an SQL query and return the results as a DataFrame.
+        Execute an SQL query and return its results.
+        
+        SELECT results are capped at MAX_RESULT_ROWS rows; rows past the cap
+        are never fetched from SQLite. Statements that don't return rows only
+        build a DataFrame if the result's df is accessed.
         
         Args:
             query: SQL query to execute
             
         Returns:
-            Tuple containing:
-            - DataFrame with query results
-            - Error message (if any)
-            - Execution time in seconds
+            QueryResult with the results, error (if any), execution time and
+            whether the results were truncated to MAX_RESULT_ROWS
         """
         import time
         
         error = None
-        df = pd.DataFrame()
+        truncated = False
+        df = None
+        message = None
+        row_count = -1
         start_time = time.time()
         
-        # Clean up the query and split if multiple statements
-        # Remove comments and extra whitespace
-        query = re.sub(r'--.*$', '', query, flags=re.MULTILINE)
-        query = re.sub(r'/\*.*?\*/', '', query, flags=re.DOTALL)
-        query = query.strip()
-        
-        # Split by semicolons and take only the first statement
-        query_parts = query.split(';')
-        if len(query_parts) > 1:
-            # If multiple statements, use only the first one
-            query = query_parts[0].strip() + ";"
-            print(f"Multiple statements detected. Using only: {query}")
+        # Remove comments and extra whitespace, keeping only the first statement
+        query, has_more = _first_statement(query)
+        if has_more:
+            logger.debug("Multiple statements detected. Using only: %s", query)
         
         try:
+            # The statement is already stripped; lowercase only the leading keyword
+            head = query[:16].lower()
             # Check if it's a PRAGMA query
-            is_pragma = query.lower().strip().startswith("pragma")
+            is_pragma = head.startswith("pragma")
             # Check if it's a SELECT query (read operation)
-            is_select = query.lower().strip().startswith("select") or query.lower().strip().startswith("with")
+            is_select = head.startswith(("select", "with"))
             
-            print(f"Executing query: {query}")
+            logger.debug("Executing query: %s", query)
             
             if is_pragma:
                 # Special handling for PRAGMA queries
@@ -93,28 +297,193 @@ class DatabaseConnector:
                 columns = [desc[0] for desc in cursor.description] if cursor.description else []
                 data = cursor.fetchall()
                 df = pd.DataFrame(data, columns=columns)
-                print(f"PRAGMA query returned {len(df)} rows")
+                logger.debug("PRAGMA query returned %d rows", len(df))
             elif is_select:
-                df = pd.read_sql_query(query, self.conn)
-                print(f"SELECT query returned {len(df)} rows")
+                # SQLite steps rows lazily, so fetching one row past the cap bounds
+                # the work and memory while still telling us if more rows exist
+                chunk = next(self.iter_query(query, chunk_size=MAX_RESULT_ROWS + 1))
+                truncated = len(chunk) > MAX_RESULT_ROWS
+                df = chunk.iloc[:MAX_RESULT_ROWS]
+                logger.debug("SELECT query returned %d rows (truncated: %s)", len(df), truncated)
             else:
                 # For non-SELECT queries (INSERT, UPDATE, DELETE, etc.)
-                cursor = self.conn.cursor()
-                cursor.execute(query)
-                self.conn.commit()
-                
-                # Get affected row count
-                row_count = cursor.rowcount
-                df = pd.DataFrame([{"message": f"Query executed successfully. {row_count} row(s) affected."}])
-                print(f"Non-SELECT query affected {row_count} rows")
+                # Writes are serialized; the connection is in autocommit mode
+                with self._write_lock:
+                    cursor = self.conn.cursor()
+                    cursor.execute(query)
+                    
+                    # Get affected row count
+                    row_count = cursor.rowcount
+                message = f"Query executed successfully. {row_count} row(s) affected."
+                logger.debug("Non-SELECT query affected %d rows", row_count)
                 
         except sqlite3.Error as e:
             error = str(e)
-            print(f"Query execution error: {error}")
+            logger.debug("Query execution error: %s", error)
         
         execution_time = time.time() - start_time
         
-        return df, error, execution_time
+        return QueryResult(df, message, row_count, error, execution_time, truncated)
+    
+    def iter_query(self, query: str, chunk_size: int = 1000) -> Iterator[pd.DataFrame]:
+        """
+        Execute a query and yield its results in DataFrame chunks.
+        
+        Args:
+            query: SQL query to execute
+            chunk_size: Maximum number of rows per chunk
+            
+        Yields:
+            DataFrames with up to chunk_size rows each (a single empty
+            DataFrame with the result columns if there are no rows)
+        """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query)
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                yield pd.DataFrame(columns=columns)
+            while rows:
+                yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+                rows = cursor.fetchmany(chunk_size)
+        finally:
+            cursor.close()
+    
+    def get_keyset_column(self, query: str) -> Optional[str]:
+        """
+        Find a column that a query's results can be paginated on.
+        
+        Keyset pagination skips rows that tie with the last key, so the column
+        must be known to be unique: the query has to select plain columns from a
+        single table and be ordered by that table's single-column primary key or
+        a single-column UNIQUE index.
+        
+        Args:
+            query: SQL SELECT query
+            
+        Returns:
+            Name of the unique column the query is ordered by, or None if the query
+            does not end with ORDER BY on such a column (ascending)
+        """
+        statement, _ = _first_statement(query)
+        match = _ORDER_BY_TAIL_RE.search(statement)
+        source = _KEYSET_SOURCE_RE.match(statement)
+        if not match or not source:
+            return None
+        
+        column = _unquote_ident(match.group(1))
+        table = _unquote_ident(source.group(1))
+        return column if self._is_unique_column(table, column) else None
+    
+    def _is_unique_column(self, table_name: str, column: str) -> bool:
+        """
+        Check whether a table's schema guarantees a column holds unique values.
+        
+        Args:
+            table_name: Name of the table
+            column: Name of the column
+            
+        Returns:
+            True if the column is the table's only primary key column or has a
+            single-column UNIQUE index
+        """
+        try:
+            cursor = self.conn.cursor()
+            # pk numbers the columns of a composite primary key 1, 2, ...
+            cursor.execute("SELECT name FROM pragma_table_info(?) WHERE pk > 0", (table_name,))
+            primary_key = [row[0] for row in cursor.fetchall()]
+            if len(primary_key) == 1 and primary_key[0].lower() == column.lower():
+                return True
+            
+            cursor.execute(
+                """
+                SELECT 1 FROM pragma_index_list(?) AS il
+                WHERE il."unique" = 1
+                  AND (SELECT COUNT(*) FROM pragma_index_info(il.name)) = 1
+                  AND (SELECT name FROM pragma_index_info(il.name)) = ? COLLATE NOCASE
+                LIMIT 1
+                """,
+                (table_name, column)
+            )
+            return cursor.fetchone() is not None
+        except sqlite3.Error as e:
+            logger.debug("Could not check uniqueness of %s.%s: %s", table_name, column, e)
+            return False
+    
+    def execute_query_paginated(
+        self,
+        query: str,
+        order_col: str,
+        last_key=None,
+        limit: int = 100
+    ) -> Tuple[pd.DataFrame, Optional[str], float, Optional[object], bool]:
+        """
+        Fetch one page of a query's results using keyset pagination.
+        
+        Rows are filtered with WHERE order_col > last_key rather than OFFSET, so
+        every page costs the same regardless of how far in it is. order_col must
+        hold unique values (see get_keyset_column); rows that tie with last_key
+        are skipped.
+        
+        Args:
+            query: SQL SELECT query
+            order_col: Result column to order and paginate by
+            last_key: Value of order_col in the last row of the previous page
+                      (None for the first page)
+            limit: Maximum number of rows per page
+            
+        Returns:
+            Tuple containing:
+            - DataFrame with the page of results
+            - Error message (if any)
+            - Execution time in seconds
+            - Key to pass as last_key for the next page
+            - Whether more rows follow this page
+        """
+        import time
+        
+        error = None
+        has_more = False
+        next_key = last_key
+        df = pd.DataFrame()
+        start_time = time.time()
+        
+        statement, _ = _first_statement(query)
+        column = _quote_ident(order_col)
+        paged_query = f"SELECT * FROM ({statement.rstrip(';')})"
+        params = []
+        if last_key is not None:
+            # sqlite3 can't bind NumPy scalars taken from a previous page's DataFrame
+            if hasattr(last_key, "item"):
+                last_key = last_key.item()
+            paged_query += f" WHERE {column} > ?"
+            params.append(last_key)
+        paged_query += f" ORDER BY {column} LIMIT ?"
+        # One row past the page tells us whether another page exists
+        params.append(limit + 1)
+        
+        try:
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute(paged_query, params)
+                columns = [desc[0] for desc in cursor.description]
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+            
+            has_more = len(rows) > limit
+            df = pd.DataFrame.from_records(rows[:limit], columns=columns, coerce_float=True)
+            if not df.empty:
+                next_key = df[order_col].iloc[-1]
+            logger.debug("Paginated query returned %d rows (more: %s)", len(df), has_more)
+        except sqlite3.Error as e:
+            error = str(e)
+            logger.debug("Paginated query error: %s", error)
+        
+        execution_time = time.time() - start_time
+        
+        return df, error, execution_time, next_key, has_more
     
     def get_table_names(self) -> List[str]:
         """
@@ -126,7 +495,7 @@ class DatabaseConnector:
         cursor = self.conn.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
         tables = [row[0] for row in cursor.fetchall()]
-        print(f"Found tables: {tables}")
+        logger.debug("Found tables: %s", tables)
         return tables
     
     def get_table_info(self, table_name: str) -> List[Dict]:
@@ -140,21 +509,10 @@ class DatabaseConnector:
             List of dictionaries containing column information
         """
         cursor = self.conn.cursor()
-        cursor.execute(f"PRAGMA table_info({table_name})")
+        # Table-valued pragma so the name is bound, and the statement reused from sqlite3's cache
+        cursor.execute("SELECT * FROM pragma_table_info(?)", (table_name,))
         
-        columns = []
-        for row in cursor.fetchall():
-            column = {
-                "cid": row[0],
-                "name": row[1],
-                "type": row[2],
-                "notnull": row[3],
-                "default_value": row[4],
-                "is_primary_key": row[5] == 1
-            }
-            columns.append(column)
-            
-        return columns
+        return [_column_from_row(row) for row in cursor.fetchall()]
     
     def get_foreign_keys(self, table_name: str) -> List[Dict]:
         """
@@ -167,24 +525,67 @@ class DatabaseConnector:
             List of dictionaries containing foreign key information
         """
         cursor = self.conn.cursor()
-        cursor.execute(f"PRAGMA foreign_key_list({table_name})")
+        cursor.execute("SELECT * FROM pragma_foreign_key_list(?)", (table_name,))
+        
+        return [_foreign_key_from_row(row) for row in cursor.fetchall()]
+    
+    def get_all_table_columns(self) -> Dict[str, List[Dict]]:
+        """
+        Get column information for every table in a single query.
         
-        foreign_keys = []
+        Returns:
+            Dictionary mapping table names to lists of column dictionaries
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT m.name, p.* FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+            "WHERE m.type='table' AND m.name NOT LIKE 'sqlite_%'"
+        )
+        
+        columns = {}
         for row in cursor.fetchall():
-            fk = {
-                "id": row[0],
-                "seq": row[1],
-                "table": row[2],
-                "from": row[3],
-                "to": row[4],
-                "on_update": row[5],
-                "on_delete": row[6],
-                "match": row[7]
-            }
-            foreign_keys.append(fk)
-            
+            columns.setdefault(row[0], []).append(_column_from_row(row[1:]))
+        
+        return columns
+    
+    def get_all_foreign_keys(self) -> Dict[str, List[Dict]]:
+        """
+        Get foreign key information for every table in a single query.
+        
+        Returns:
+            Dictionary mapping table names to lists of foreign key dictionaries
+            (tables without foreign keys are omitted)
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT m.name, p.* FROM sqlite_master m JOIN pragma_foreign_key_list(m.name) p "
+            "WHERE m.type='table' AND m.name NOT LIKE 'sqlite_%'"
+        )
+        
+        foreign_keys = {}
+        for row in cursor.fetchall():
+            foreign_keys.setdefault(row[0], []).append(_foreign_key_from_row(row[1:]))
+        
         return foreign_keys
     
+    def get_all_sample_data(self, table_names: List[str], limit: int = 5) -> Dict[str, pd.DataFrame]:
+        """
+        Get sample data from several tables within a single read transaction.
+        
+        Args:
+            table_names: Names of the tables
+            limit: Maximum number of rows to return per table
+            
+        Returns:
+            Dictionary mapping table names to DataFrames containing sample data
+        """
+        samples = {}
+        with self.transaction():
+            for table_name in table_names:
+                samples[table_name] = self.get_sample_data(table_name, limit)
+        
+        return samples
+    
     def get_sample_data(self, table_name: str, limit: int = 5) -> pd.DataFrame:
         """
         Get sample data from a table.
@@ -197,6 +598,6 @@ class DatabaseConnector:
             DataFrame containing sample data
         """
         try:
-            return pd.read_sql_query(f"SELECT * FROM {table_name} LIMIT {limit}", self.conn)
+            return pd.read_sql_query(f"SELECT * FROM {_quote_ident(table_name)} LIMIT ?", self.conn, params=(limit,))
         except sqlite3.Error:
             return pd.DataFrame()
\ No newline at end of file
@@ -1,11 +1,21 @@
 """
 Schema extraction utilities for SQLite databases.
 """
-import pandas as pd
+import textwrap
 from typing import Dict, List, Any
 from .connector import DatabaseConnector
 from config import MAX_SAMPLE_ROWS
 
+
+def _format_sql_value(value: Any) -> str:
+    """Format a sample value as an SQL literal for INSERT statements."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, str):
+        return f"'{value}'"
+    return str(value)
+
+
 class SchemaExtractor:
     """Extracts and formats database schema information."""
     
@@ -17,11 +27,39 @@ class SchemaExtractor:
             db_connector: Database connector instance
         """
         self.db_connector = db_connector
+        # Extracted schema and formatted strings, valid while the database files are unchanged
+        self._full_schema_cache = None
+        self._text_cache = {}
+        self._cache_signature = None
+    
+    def _invalidate_if_changed(self) -> None:
+        """Drop cached schema information if the database has been modified."""
+        signature = self.db_connector.file_signature()
+        if signature != self._cache_signature:
+            self._full_schema_cache = None
+            self._text_cache = {}
+            self._cache_signature = signature
     
     def get_full_schema(self) -> Dict[str, Any]:
         """
         Extract the full database schema including tables, columns, keys and relationships.
         
+        The result is cached until the database file changes.
+        
+        Returns:
+            Dictionary containing the complete schema information
+        """
+        self._invalidate_if_changed()
+        if self._full_schema_cache is None:
+            self._full_schema_cache = self._extract_full_schema()
+            # Reading can create the WAL file, so take the signature again afterwards
+            self._cache_signature = self.db_connector.file_signature()
+        return self._full_schema_cache
+    
+    def _extract_full_schema(self) -> Dict[str, Any]:
+        """
+        Query the database for tables, columns, foreign keys and sample data.
+        
         Returns:
             Dictionary containing the complete schema information
         """
@@ -30,20 +68,25 @@ class SchemaExtractor:
             "tables": {}
         }
         
+        # Fetch columns, foreign keys and sample rows for all tables at once
+        all_columns = self.db_connector.get_all_table_columns()
+        all_foreign_keys = self.db_connector.get_all_foreign_keys()
+        all_sample_data = self.db_connector.get_all_sample_data(tables, limit=MAX_SAMPLE_ROWS)
+        
         for table in tables:
             # Get table columns
-            columns = self.db_connector.get_table_info(table)
+            columns = all_columns.get(table, [])
             
             # Get foreign keys
-            foreign_keys = self.db_connector.get_foreign_keys(table)
+            foreign_keys = all_foreign_keys.get(table, [])
             
             # Get sample data
-            sample_data = self.db_connector.get_sample_data(table, limit=MAX_SAMPLE_ROWS)
+            sample_data = all_sample_data[table]
             
             schema["tables"][table] = {
                 "columns": columns,
                 "foreign_keys": foreign_keys,
-                "sample_data": sample_data.to_dict(orient="records") if not sample_data.empty else []
+                "sample_data": sample_data
             }
         
         return schema
@@ -56,53 +99,62 @@ class SchemaExtractor:
             String containing the formatted schema summary
         """
         schema = self.get_full_schema()
-        summary = "DATABASE SCHEMA:\n\n"
+        if "summary" not in self._text_cache:
+            self._text_cache["summary"] = self._format_schema_summary(schema)
+        return self._text_cache["summary"]
+    
+    def _format_schema_summary(self, schema: Dict[str, Any]) -> str:
+        """
+        Format extracted schema information as a human-readable summary.
+        
+        Args:
+            schema: Schema information from get_full_schema
+            
+        Returns:
+            String containing the formatted schema summary
+        """
+        parts = ["DATABASE SCHEMA:\n\n"]
         
         for table_name, table_info in schema["tables"].items():
-            summary += f"Table: {table_name}\n"
+            parts.append(f"Table: {table_name}\n")
             
             # Add column information
-            summary += "Columns:\n"
+            parts.append("Columns:\n")
             for col in table_info["columns"]:
                 pk_marker = "PRIMARY KEY" if col["is_primary_key"] else ""
                 null_marker = "NOT NULL" if col["notnull"] else "NULL"
-                summary += f"  - {col['name']} ({col['type']}) {pk_marker} {null_marker}\n"
+                parts.append(f"  - {col['name']} ({col['type']}) {pk_marker} {null_marker}\n")
             
             # Add foreign key information
             if table_info["foreign_keys"]:
-                summary += "Foreign Keys:\n"
+                parts.append("Foreign Keys:\n")
                 for fk in table_info["foreign_keys"]:
-                    summary += f"  - {fk['from']} -> {fk['table']}.{fk['to']}\n"
+                    parts.append(f"  - {fk['from']} -> {fk['table']}.{fk['to']}\n")
             
             # Add sample data preview
-            if table_info["sample_data"]:
-                summary += "Sample Data:\n"
+            if not table_info["sample_data"].empty:
+                parts.append("Sample Data:\n")
                 
-                # Convert to DataFrame for formatting
-                df = pd.DataFrame(table_info["sample_data"])
+                df = table_info["sample_data"]
                 
                 # Format the sample data as a string-based table with limited columns
-                # If too many columns, show only the first few
-                if len(df.columns) > 5:
-                    preview_df = df.iloc[:, :5]
-                    col_truncated = True
-                else:
-                    preview_df = df
-                    col_truncated = False
+                # If too many columns, show only the first few. Slice before formatting
+                # so to_string only ever sees the cells that are shown
+                col_truncated = len(df.columns) > 5
+                preview_df = df.iloc[:MAX_SAMPLE_ROWS, :5]
                 
                 # Format as string table 
                 table_str = preview_df.to_string(index=False)
                 
                 # Add the table string with proper indentation
-                for line in table_str.split('\n'):
-                    summary += f"  {line}\n"
+                parts.append(textwrap.indent(table_str, "  ") + "\n")
                 
                 if col_truncated:
-                    summary += "  ... (more columns not shown)\n"
+                    parts.append("  ... (more columns not shown)\n")
             
-            summary += "\n"
+            parts.append("\n")
         
-        return summary
+        return "".join(parts)
     
     def get_schema_for_prompt(self) -> str:
         """
@@ -112,55 +164,63 @@ class SchemaExtractor:
             String containing the schema in a format suitable for LLM context
         """
         schema = self.get_full_schema()
-        prompt_schema = "DATABASE SCHEMA:\n\n"
+        if "prompt" not in self._text_cache:
+            self._text_cache["prompt"] = self._format_schema_for_prompt(schema)
+        return self._text_cache["prompt"]
+    
+    def _format_schema_for_prompt(self, schema: Dict[str, Any]) -> str:
+        """
+        Format extracted schema information for LLM prompts.
         
-        for table_name, table_info in schema["tables"].items():
-            prompt_schema += f"Table: {table_name}\n"
-            
-            # Add CREATE TABLE statement
-            prompt_schema += "CREATE TABLE statement:\n"
-            create_stmt = "CREATE TABLE " + table_name + " (\n"
+        Args:
+            schema: Schema information from get_full_schema
             
-            # Add columns
-            for i, col in enumerate(table_info["columns"]):
-                pk_marker = "PRIMARY KEY" if col["is_primary_key"] else ""
-                null_marker = "NOT NULL" if col["notnull"] else ""
-                
-                create_stmt += f"  {col['name']} {col['type']} {pk_marker} {null_marker}"
-                
-                if i < len(table_info["columns"]) - 1 or table_info["foreign_keys"]:
-                    create_stmt += ","
-                create_stmt += "\n"
+        Returns:
+            String containing the schema in a format suitable for LLM context
+        """
+        parts = ["DATABASE SCHEMA:\n\n"]
+        # Relationship lines are collected alongside the tables and emitted at the end
+        relationships = []
+        
+        for table_name, table_info in schema["tables"].items():
+            parts.append(f"Table: {table_name}\n")
             
-            # Add foreign keys
-            for i, fk in enumerate(table_info["foreign_keys"]):
-                create_stmt += f"  FOREIGN KEY ({fk['from']}) REFERENCES {fk['table']}({fk['to']})"
-                if i < len(table_info["foreign_keys"]) - 1:
-                    create_stmt += ","
-                create_stmt += "\n"
+            for fk in table_info["foreign_keys"]:
+                relationships.append(f"- {table_name}.{fk['from']} references {fk['table']}.{fk['to']}\n")
             
-            create_stmt += ");\n"
-            prompt_schema += create_stmt + "\n"
+            # Add CREATE TABLE statement
+            parts.append("CREATE TABLE statement:\n")
+            # One line per column and foreign key; joining them places the commas
+            col_lines = [
+                f"  {col['name']} {col['type']} {'PRIMARY KEY' if col['is_primary_key'] else ''} "
+                f"{'NOT NULL' if col['notnull'] else ''}".rstrip()
+                for col in table_info["columns"]
+            ]
+            fk_lines = [
+                f"  FOREIGN KEY ({fk['from']}) REFERENCES {fk['table']}({fk['to']})"
+                for fk in table_info["foreign_keys"]
+            ]
+            parts.append(f"CREATE TABLE {table_name} (\n" + ",\n".join(col_lines + fk_lines) + "\n);\n\n")
             
             # Add sample data in INSERT statement format
-            if table_info["sample_data"]:
-                prompt_schema += "Sample Data:\n"
+            if not table_info["sample_data"].empty:
+                parts.append("Sample Data:\n")
                 
-                for row in table_info["sample_data"][:3]:  # Limit to 3 sample rows for prompt
-                    col_names = ", ".join(row.keys())
-                    col_values = ", ".join([f"'{v}'" if isinstance(v, str) else str(v) if v is not None else "NULL" for v in row.values()])
-                    prompt_schema += f"INSERT INTO {table_name} ({col_names}) VALUES ({col_values});\n"
+                # Limit to 3 sample rows for prompt, formatted a column at a time
+                sample = table_info["sample_data"].head(3)
+                quoted = sample.apply(lambda col: col.astype(object).map(_format_sql_value))
+                values = quoted.agg(", ".join, axis=1)
+                prefix = f"INSERT INTO {table_name} ({', '.join(sample.columns)}) VALUES ("
+                parts.extend(prefix + values + ");\n")
                 
                 if len(table_info["sample_data"]) > 3:
-                    prompt_schema += "-- (more rows exist)\n"
+                    parts.append("-- (more rows exist)\n")
             
-            prompt_schema += "\n"
+            parts.append("\n")
         
         # Add relationship descriptions
-        prompt_schema += "TABLE RELATIONSHIPS:\n"
-        for table_name, table_info in schema["tables"].items():
-            for fk in table_info["foreign_keys"]:
-                prompt_schema += f"- {table_name}.{fk['from']} references {fk['table']}.{fk['to']}\n"
+        parts.append("TABLE RELATIONSHIPS:\n")
+        parts.extend(relationships)
         
-        prompt_schema += "\n"
-        return prompt_schema
\ No newline at end of file
+        parts.append("\n")
+        return "".join(parts)
\ No newline at end of file
@@ -2,29 +2,66 @@
 SQLite AI Chatbot using Gradio interface.
 """
 import os
+import re
 import time
+import shutil
+import hashlib
+from collections import OrderedDict
 import pandas as pd
-import gradio as gr
 import config
 from typing import Dict, List, Tuple, Any
 
 # Import local modules
 from database import DatabaseConnector, SchemaExtractor
-from llm import GeminiAPI, PromptBuilder
-from utils import QueryProcessor, ResponseFormatter
+from llm import GeminiAPI, PromptBuilder, ResponseCache, PersistentCache
+from utils import QueryProcessor, parse_llm_response
 
 # Initialize global variables
 db_connector = None
+schema_extractor = None
 schema_info = None
+schema_hash = None
+prompt_builder = None
 llm_api = GeminiAPI()
+# LLM responses keyed by schema, recent questions and the normalized query
+response_cache = ResponseCache(max_entries=config.RESPONSE_CACHE_MAX_ENTRIES)
+persistent_cache = PersistentCache(config.RESPONSE_CACHE_PATH, max_age=config.RESPONSE_CACHE_MAX_AGE)
+# Read query results keyed by database file signature and whitespace-normalized SQL
+result_cache = OrderedDict()
 temp_file_path = None
 chat_history = []
 
+def _remove_database_files(db_path: str) -> None:
+    """Delete a database copy along with its WAL and shared-memory files."""
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def close_db_connection() -> None:
+    """Close the database connection and delete its temporary copy."""
+    global db_connector, temp_file_path
+    
+    if db_connector:
+        db_connector.disconnect()
+        db_connector = None
+    
+    if temp_file_path:
+        _remove_database_files(temp_file_path)
+        temp_file_path = None
+    
+    # Cached results belong to the closed copy
+    result_cache.clear()
+
 def initialize_db_connection(db_file) -> Tuple[bool, str]:
     """
     Initialize database connection from uploaded file.
     """
-    global db_connector, schema_info, temp_file_path
+    global db_connector, schema_extractor, schema_info, schema_hash, prompt_builder, temp_file_path
+    
+    # Connecting again replaces the previous copy
+    close_db_connection()
     
     try:
         # Create a temporary file to store the uploaded DB
@@ -38,76 +75,113 @@ def initialize_db_connection(db_file) -> Tuple[bool, str]:
         # Get the file path
         db_path = db_file.name
         
-        # Copy the file
-        import shutil
-        shutil.copy(db_path, temp_file_path)
+        # Copy the file in 1 MiB chunks. Queries may write to the copy, so it can't
+        # share its data with the upload through a hard link
+        with open(db_path, "rb") as source, open(temp_file_path, "wb") as target:
+            shutil.copyfileobj(source, target, 1 << 20)
         
         # Test the connection
         db_connector = DatabaseConnector(temp_file_path)
         
-        # Extract schema information
+        # Extract schema information (the extractor caches it for later views)
         schema_extractor = SchemaExtractor(db_connector)
         schema_info = schema_extractor.get_schema_for_prompt()
+        schema_hash = hashlib.blake2b(schema_info.encode("utf-8"), digest_size=16).hexdigest()
+        
+        # The schema is fixed for the connection, so one prompt builder serves every turn
+        prompt_builder = PromptBuilder(schema_info)
         
         return f"✅ Connected to database: {os.path.basename(db_path)}"
     
     except Exception as e:
+        close_db_connection()
         return f"❌ Error connecting to database: {str(e)}"
 
 def execute_sql_directly(query: str):
-    """Execute an SQL query directly and return results."""
+    """Execute an SQL query directly and return results and whether they were truncated."""
     global db_connector
     
     if not db_connector:
-        return None, "No database connection"
+        return None, "No database connection", False
+    
+    # Only read queries are cached; the signature changes whenever the database is written.
+    # Case is kept in the key because string literals are case-sensitive
+    cache_key = None
+    if QueryProcessor(db_connector).is_read_query(query):
+        cache_key = (db_connector.file_signature(), re.sub(r'\s+', ' ', query.strip()))
+        if cache_key in result_cache:
+            result_cache.move_to_end(cache_key)
+            return result_cache[cache_key]
     
     try:
         # Execute the query
-        df, error, _ = db_connector.execute_query(query)
-        return df, error
+        result = db_connector.execute_query(query)
+        results = (result.df, result.error, result.truncated)
     except Exception as e:
-        return None, str(e)
+        return None, str(e), False
+    
+    if cache_key is not None and result.error is None:
+        result_cache[cache_key] = results
+        if len(result_cache) > config.RESULT_CACHE_MAX_ENTRIES:
+            result_cache.popitem(last=False)
+    
+    return results
 
-def process_query(user_query: str, history: List[List[str]]) -> List[List[str]]:
+def process_query(
+    user_query: str, history: List[List[str]], llm_responses: List[Any]
+) -> Tuple[List[List[str]], List[Any]]:
     """
     Process a user's natural language query and update chat history.
+    
+    llm_responses holds this session's raw LLM response for each chat turn (None
+    for turns that got none), so the context sent to the LLM carries no UI text.
     """
-    global db_connector, schema_info, llm_api, chat_history
+    global db_connector, schema_hash, prompt_builder, llm_api, chat_history
     
     # Check if database is connected
     if not db_connector:
-        return history + [[user_query, "Please connect to a database first."]]
-    
-    # Initialize LLM components
-    prompt_builder = PromptBuilder(schema_info)
-    
-    # Convert chat history to format expected by LLM
-    formatted_history = []
-    for i, [user_msg, _] in enumerate(history):
-        formatted_history.append(prompt_builder.build_user_message(user_msg))
-        if i < len(chat_history) and "raw_content" in chat_history[i]:
-            formatted_history.append(prompt_builder.build_assistant_message(chat_history[i]["raw_content"]))
+        return history + [[user_query, "Please connect to a database first."]], llm_responses + [None]
     
-    # Build messages with conversation history
-    messages = prompt_builder.build_messages(user_query, formatted_history)
+    # The answer depends on the schema and the last couple of questions as well as the query
+    context_hash = hashlib.blake2b(
+        "\0".join([schema_hash] + [user_msg for user_msg, _ in history[-2:]]).encode("utf-8"), digest_size=16
+    ).hexdigest()
+    cache_key = ResponseCache.make_key(context_hash, user_query)
     
-    # Generate response from LLM
-    try:
-        response = llm_api.generate_response(
-            messages, 
-            temperature=0.2,
-            max_tokens=2048,
-            timeout=300
-        )
-    except Exception as e:
-        error_message = f"Error: {str(e)}"
-        return history + [[user_query, error_message]]
+    # Reuse a cached response, checking memory before the persistent cache
+    cached = response_cache.get(context_hash, user_query)
+    response = cached["llm_response"] if cached is not None else persistent_cache.get(cache_key)
     
-    if not response:
-        return history + [[user_query, "Failed to generate response from LLM."]]
+    if response is None:
+        # Convert this session's chat to the format expected by LLM. Only the turns
+        # build_messages keeps are converted
+        formatted_history = []
+        recent = zip(history[-config.MAX_HISTORY_LENGTH:], llm_responses[-config.MAX_HISTORY_LENGTH:])
+        for (user_msg, _), raw_content in recent:
+            formatted_history.append(prompt_builder.build_user_message(user_msg))
+            if raw_content is not None:
+                formatted_history.append(prompt_builder.build_assistant_message(raw_content))
+        
+        # Build messages with conversation history
+        messages = prompt_builder.build_messages(user_query, formatted_history)
+        
+        # Generate response from LLM
+        try:
+            response = llm_api.generate_response(
+                messages, 
+                temperature=0.2,
+                max_tokens=2048,
+                timeout=300
+            )
+        except Exception as e:
+            error_message = f"Error: {str(e)}"
+            return history + [[user_query, error_message]], llm_responses + [None]
+        
+        if not response:
+            return history + [[user_query, "Failed to generate response from LLM."]], llm_responses + [None]
     
     # Parse LLM response
-    parsed_response = ResponseFormatter.parse_llm_response(response)
+    parsed_response = parse_llm_response(response)
     
     # Extract SQL query from response
     sql_query = llm_api.extract_sql_from_response(response)
@@ -118,15 +192,26 @@ def process_query(user_query: str, history: List[List[str]]) -> List[List[str]]:
     # If SQL query was extracted, execute it
     if sql_query:
         # Execute the query directly
-        results_df, error = execute_sql_directly(sql_query)
+        results_df, error, truncated = execute_sql_directly(sql_query)
         
         if error:
             display_response += f"\n\n**SQL Error**: {error}"
         else:
             # Store the results in chat history for later reference
-            result_info = f"\n\n**Query Results:**\n{len(results_df)} row(s) returned"
+            if truncated:
+                result_info = f"\n\n**Query Results:**\nShowing the first {len(results_df)} row(s)"
+            else:
+                result_info = f"\n\n**Query Results:**\n{len(results_df)} row(s) returned"
             display_response += result_info
             
+            # Only answers whose SQL ran are cached, so a retry asks the LLM again
+            if cached is None:
+                persistent_cache.put(cache_key, response)
+                # Only answers with read queries are kept in memory: the semantic
+                # tier could otherwise match a differently worded write
+                if QueryProcessor(db_connector).is_read_query(sql_query):
+                    response_cache.put(context_hash, user_query, {"llm_response": response})
+            
             # Store the raw content for future context
             chat_entry = {
                 "raw_content": response,
@@ -137,9 +222,9 @@ def process_query(user_query: str, history: List[List[str]]) -> List[List[str]]:
     else:
         display_response += "\n\n**Error**: Could not extract SQL query from response."
     
-    return history + [[user_query, display_response]]
+    return history + [[user_query, display_response]], llm_responses + [response]
 
-def view_results(history: List[List[str]]) -> gr.Dataframe:
+def view_results(history: List[List[str]]) -> pd.DataFrame:
     """Get the most recent query results as a dataframe."""
     if chat_history and "results" in chat_history[-1]:
         return chat_history[-1]["results"]
@@ -147,123 +232,130 @@ def view_results(history: List[List[str]]) -> gr.Dataframe:
 
 def view_schema() -> str:
     """Get and format schema for display."""
-    global db_connector
+    global db_connector, schema_extractor
     
     if not db_connector:
         return "Please connect to a database first."
     
-    schema_extractor = SchemaExtractor(db_connector)
     schema_summary = schema_extractor.get_schema_summary()
     return schema_summary
 
-def reset_state() -> Tuple[List[List[str]], pd.DataFrame]:
+def reset_state() -> Tuple[List[List[str]], pd.DataFrame, List[Any]]:
     """Reset the application state."""
-    global db_connector, schema_info, llm_api, temp_file_path, chat_history
+    global schema_extractor, schema_info, schema_hash, prompt_builder, llm_api, chat_history
     
-    # Clean up database connection
-    if db_connector:
-        db_connector.disconnect()
-        db_connector = None
-    
-    # Clean up temporary file
-    if temp_file_path and os.path.exists(temp_file_path):
-        try:
-            os.remove(temp_file_path)
-        except OSError:
-            pass
+    # Clean up database connection and its temporary files
+    close_db_connection()
     
     # Reset variables
+    schema_extractor = None
     schema_info = None
+    schema_hash = None
+    prompt_builder = None
     llm_api = GeminiAPI()  # Create new instance
-    temp_file_path = None
     chat_history = []
     
-    # Return empty history and dataframe
-    return [], pd.DataFrame()
+    # Return empty history, dataframe and LLM responses
+    return [], pd.DataFrame(), []
 
-# Create Gradio interface
-with gr.Blocks(title="SQLite AI Chatbot", css="footer {visibility: hidden}") as app:
-    gr.Markdown("# SQLite AI Chatbot")
-    gr.Markdown(f"Using model: {config.LLM_MODEL_NAME}")
+def build_app():
+    """
+    Create the Gradio interface.
     
-    with gr.Row():
-        # Main content area (70%)
-        with gr.Column(scale=7):
-            chatbot = gr.Chatbot(
-                height=500,
-                label="Chat",
-                show_copy_button=True,
-                type="messages"
-            )
-            
-            # Query input
-            with gr.Row():
-                query_input = gr.Textbox(
-                    placeholder="Enter your question about the database...",
-                    label="Query",
-                    lines=3
-                )
-                
-            # Buttons
-            with gr.Row():
-                submit_btn = gr.Button("Send", variant="primary")
-                clear_btn = gr.Button("Clear Chat")
-            
-            # Results display
-            with gr.Accordion("Query Results", open=False):
-                results_df = gr.Dataframe(interactive=False)
+    Gradio is imported here so that importing this module (for its handlers) and
+    process startup don't pay for it before the UI is actually built.
+    
+    Returns:
+        Gradio Blocks app
+    """
+    import gradio as gr
+    
+    with gr.Blocks(title="SQLite AI Chatbot", css="footer {visibility: hidden}") as app:
+        gr.Markdown("# SQLite AI Chatbot")
+        gr.Markdown(f"Using model: {config.LLM_MODEL_NAME}")
         
-        # Sidebar (30%)
-        with gr.Column(scale=3):
-            # Database connection
-            with gr.Group():
-                gr.Markdown("### Database Connection")
-                db_file = gr.File(label="Upload SQLite Database")
-                connect_btn = gr.Button("Connect to Database")
-                connection_status = gr.Textbox(label="Status", interactive=False)
-            
-            # View schema
-            with gr.Group():
-                gr.Markdown("### Database Schema")
-                view_schema_btn = gr.Button("View Schema")
-                schema_display = gr.Textbox(
-                    label="Schema",
-                    interactive=False,
-                    lines=10
+        with gr.Row():
+            # Main content area (70%)
+            with gr.Column(scale=7):
+                chatbot = gr.Chatbot(
+                    height=500,
+                    label="Chat",
+                    show_copy_button=True,
+                    type="messages"
                 )
-            
-            # Example queries
-            with gr.Accordion("Example Queries", open=True):
-                gr.Markdown("""
-                ### Basic Queries:
-                - List all tables in the database
-                - Show me all fields in the FILM table
-                - How many customers are there in total?
+                # Raw LLM response per chat turn, kept per session
+                llm_responses = gr.State([])
                 
-                ### Intermediate Queries:
-                - Find all films in English language
-                - List the top 5 customers with the most rentals
-                - Find films that cost more than $20 to replace
+                # Query input
+                with gr.Row():
+                    query_input = gr.Textbox(
+                        placeholder="Enter your question about the database...",
+                        label="Query",
+                        lines=3
+                    )
+                    
+                # Buttons
+                with gr.Row():
+                    submit_btn = gr.Button("Send", variant="primary")
+                    clear_btn = gr.Button("Clear Chat")
                 
-                ### Complex Queries:
-                - Which customers have rented films but never made a payment?
-                - List films that have been rented more than 5 times, sorted by popularity
-                - Find actors who have appeared in films across multiple categories
-                """)
+                # Results display
+                with gr.Accordion("Query Results", open=False):
+                    results_df = gr.Dataframe(interactive=False)
             
-            # Reset
-            reset_btn = gr.Button("Reset All", variant="stop")
+            # Sidebar (30%)
+            with gr.Column(scale=3):
+                # Database connection
+                with gr.Group():
+                    gr.Markdown("### Database Connection")
+                    db_file = gr.File(label="Upload SQLite Database")
+                    connect_btn = gr.Button("Connect to Database")
+                    connection_status = gr.Textbox(label="Status", interactive=False)
+                
+                # View schema
+                with gr.Group():
+                    gr.Markdown("### Database Schema")
+                    view_schema_btn = gr.Button("View Schema")
+                    schema_display = gr.Textbox(
+                        label="Schema",
+                        interactive=False,
+                        lines=10
+                    )
+                
+                # Example queries
+                with gr.Accordion("Example Queries", open=True):
+                    gr.Markdown("""
+                    ### Basic Queries:
+                    - List all tables in the database
+                    - Show me all fields in the FILM table
+                    - How many customers are there in total?
+                    
+                    ### Intermediate Queries:
+                    - Find all films in English language
+                    - List the top 5 customers with the most rentals
+                    - Find films that cost more than $20 to replace
+                    
+                    ### Complex Queries:
+                    - Which customers have rented films but never made a payment?
+                    - List films that have been rented more than 5 times, sorted by popularity
+                    - Find actors who have appeared in films across multiple categories
+                    """)
+                
+                # Reset
+                reset_btn = gr.Button("Reset All", variant="stop")
+        
+        # Set up event handlers
+        connect_btn.click(initialize_db_connection, inputs=db_file, outputs=connection_status)
+        submit_btn.click(process_query, inputs=[query_input, chatbot, llm_responses], outputs=[chatbot, llm_responses])
+        submit_btn.click(lambda: "", inputs=None, outputs=query_input)  # Clear input after sending
+        submit_btn.click(view_results, inputs=chatbot, outputs=results_df)
+        clear_btn.click(lambda: ([], []), inputs=None, outputs=[chatbot, llm_responses])
+        view_schema_btn.click(view_schema, inputs=None, outputs=schema_display)
+        reset_btn.click(reset_state, inputs=None, outputs=[chatbot, results_df, llm_responses])
+        reset_btn.click(lambda: "", inputs=None, outputs=[connection_status, schema_display])
     
-    # Set up event handlers
-    connect_btn.click(initialize_db_connection, inputs=db_file, outputs=connection_status)
-    submit_btn.click(process_query, inputs=[query_input, chatbot], outputs=[chatbot])
-    submit_btn.click(lambda: "", inputs=None, outputs=query_input)  # Clear input after sending
-    submit_btn.click(view_results, inputs=chatbot, outputs=results_df)
-    clear_btn.click(lambda: [], inputs=None, outputs=chatbot)
-    view_schema_btn.click(view_schema, inputs=None, outputs=schema_display)
-    reset_btn.click(reset_state, inputs=None, outputs=[chatbot, results_df])
-    reset_btn.click(lambda: "", inputs=None, outputs=[connection_status, schema_display])
+    return app
 
 # Run the app
 if __name__ == "__main__":
-    app.launch(share=False)
\ No newline at end of file
+    build_app().launch(share=False)
\ No newline at end of file
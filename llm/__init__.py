@@ -3,5 +3,7 @@ LLM module initialization.
 """
 from .gemini_api import GeminiAPI
 from .prompt_builder import PromptBuilder
+from .cache import ResponseCache
+from .persistent_cache import PersistentCache
 
-__all__ = ["GeminiAPI", "PromptBuilder"]
\ No newline at end of file
+__all__ = ["GeminiAPI", "PromptBuilder", "ResponseCache", "PersistentCache"]
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+Response cache for LLM answers with exact and semantic similarity lookup.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a natural language query for cache lookups.
+
+    Args:
+        query: User's natural language query
+
+    Returns:
+        Lowercased query with punctuation stripped and whitespace collapsed
+    """
+    query = _PUNCTUATION_RE.sub(' ', query.lower())
+    return _WHITESPACE_RE.sub(' ', query).strip()
+
+
+class ResponseCache:
+    """Caches LLM responses per schema, keyed by normalized query text."""
+
+    def __init__(
+        self,
+        embed: Optional[Callable[[str], np.ndarray]] = None,
+        similarity_threshold: float = 0.92,
+        max_entries: Optional[int] = None
+    ):
+        """
+        Initialize the response cache.
+
+        Args:
+            embed: Optional function returning an embedding vector for a query;
+                   enables the semantic similarity tier when provided
+            similarity_threshold: Minimum cosine similarity for a semantic hit
+            max_entries: Maximum number of cached responses; the least recently
+                         used entry is evicted beyond this (unbounded if None)
+        """
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        # Schema each entry belongs to, for removing evicted entries' embeddings
+        self._entry_schemas: Dict[bytes, str] = {}
+        # Per schema: matrix of unit-length query embeddings and the matching entry keys
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._embedding_keys: Dict[str, List[bytes]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(schema_hash: str, query: str) -> bytes:
+        """
+        Build the exact-match key for a query against a schema.
+
+        Args:
+            schema_hash: Hash identifying the database the query targets
+            query: User's natural language query (normalized before hashing)
+
+        Returns:
+            16-byte blake2b digest
+        """
+        return hashlib.blake2b(
+            f"{schema_hash}\0{normalize_query(query)}".encode("utf-8"), digest_size=16
+        ).digest()
+
+    def _embed(self, normalized_query: str) -> np.ndarray:
+        """Embed a normalized query as a unit-length float32 vector."""
+        vector = np.asarray(self.embed(normalized_query), dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, schema_hash: str, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached response for a query.
+
+        Args:
+            schema_hash: Hash identifying the database the query targets
+            query: User's natural language query
+
+        Returns:
+            Cached entry dictionary or None if there is no hit
+        """
+        normalized = normalize_query(query)
+        key = self.make_key(schema_hash, query)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            if entry is not None or self.embed is None:
+                return entry
+            matrix = self._embeddings.get(schema_hash)
+            if matrix is None:
+                return None
+            # Copied with the matrix: eviction removes keys from the shared list in
+            # place, which would shift the indexes while scoring runs unlocked
+            keys = list(self._embedding_keys[schema_hash])
+
+        # Cosine similarity against every cached query for this schema
+        scores = matrix @ self._embed(normalized)
+        best = int(np.argmax(scores))
+        if scores[best] >= self.similarity_threshold:
+            with self._lock:
+                # The matched entry may have been evicted since the snapshot
+                entry = self._entries.get(keys[best])
+                if entry is not None:
+                    self._entries.move_to_end(keys[best])
+                return entry
+
+        return None
+
+    def put(self, schema_hash: str, query: str, entry: Dict[str, Any]) -> None:
+        """
+        Store a response in the cache.
+
+        Args:
+            schema_hash: Hash identifying the database the query targets
+            query: User's natural language query
+            entry: Dictionary with the response, SQL query and query results
+        """
+        normalized = normalize_query(query)
+        key = self.make_key(schema_hash, query)
+        vector = self._embed(normalized) if self.embed is not None else None
+
+        with self._lock:
+            is_new = key not in self._entries
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._entry_schemas[key] = schema_hash
+
+            if vector is not None and is_new:
+                matrix = self._embeddings.get(schema_hash)
+                if matrix is None:
+                    self._embeddings[schema_hash] = vector[np.newaxis, :]
+                    self._embedding_keys[schema_hash] = [key]
+                else:
+                    self._embeddings[schema_hash] = np.vstack([matrix, vector])
+                    self._embedding_keys[schema_hash].append(key)
+
+            if self.max_entries is not None:
+                while len(self._entries) > self.max_entries:
+                    self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        """Remove the least recently used entry. Must be called with the lock held."""
+        key, _ = self._entries.popitem(last=False)
+        schema_hash = self._entry_schemas.pop(key)
+
+        keys = self._embedding_keys.get(schema_hash)
+        if keys is not None and key in keys:
+            index = keys.index(key)
+            del keys[index]
+            if keys:
+                self._embeddings[schema_hash] = np.delete(self._embeddings[schema_hash], index, axis=0)
+            else:
+                del self._embeddings[schema_hash]
+                del self._embedding_keys[schema_hash]
+
+    def clear(self) -> None:
+        """Remove all cached responses."""
+        with self._lock:
+            self._entries.clear()
+            self._entry_schemas.clear()
+            self._embeddings.clear()
+            self._embedding_keys.clear()
@@ -1,36 +1,138 @@
 """
 Gemini API integration via OpenRouter with key rotation.
 """
+import asyncio
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import httpx
 import json
 import re
 import threading
 import time
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Awaitable, Callable
 import config
 import random
 
+try:
+    # Optional: faster JSON encoding of the prompt and decoding of responses
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+    _json_loads = json.loads
+
+# Patterns used to pull SQL out of LLM responses, compiled once
+_SQL_KW_RE = re.compile(r'\b(?:SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP|PRAGMA)\b', re.IGNORECASE)
+# A run of non-blank lines starting at a line that begins with an SQL keyword
+_SQL_BLOCK_RE = re.compile(
+    r'^[ \t]*(?:SELECT|FROM|WHERE|GROUP\s+BY|ORDER\s+BY|INSERT\s+INTO|UPDATE|DELETE\s+FROM|PRAGMA)\b'
+    r'.*(?:\n(?![ \t]*$).*)*',
+    re.IGNORECASE | re.MULTILINE
+)
+_LINE_COMMENT_RE = re.compile(r'--.*$', re.MULTILINE)
+_BLOCK_COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+_PRAGMA_SPLIT_RE = re.compile(r'(PRAGMA\s+[^;]+;)', re.IGNORECASE)
+# Fenced code blocks (an unterminated final block runs to the end), with the sql tag captured
+_FENCE_RE = re.compile(r'```(sql)?(.*?)(?:```|\Z)', re.DOTALL)
+
 class GeminiAPI:
     """Handles communication with the Gemini model via OpenRouter API."""
     
     def __init__(self):
         """Initialize the Gemini API client."""
         self.api_keys = config.API_KEYS
-        self.current_key_index = 0
+        # Per-key health: recent consecutive failures and when the key may be used again
+        self._key_state = {}
         self.model = config.LLM_MODEL_NAME
         self.api_url = "https://openrouter.ai/api/v1/chat/completions"
-        self._local = threading.local()
         self._lock = threading.Lock()
+        # Cancel token and open response of the in-flight generate_response call, so
+        # cancel_current_request can stop it from any thread
+        self._cancel_event = None
+        self._active_response = None
+        
+        # One session for all requests so connections and TLS sessions are kept alive;
+        # transient server errors are retried on the same key before moving to the next
+        # one. Rate limits (429) are not retried here: the key is put on cooldown and the
+        # next healthy key is tried. Retry-After is ignored so no retry outlasts its
+        # short backoff, which a cancel can't interrupt
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=8,
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.3,
+                status_forcelist=[500, 502, 503, 504],
+                allowed_methods=frozenset(["POST"]),
+                respect_retry_after_header=False,
+                raise_on_status=False
+            )
+        )
+        self._session.mount("https://", adapter)
         
         if not self.api_keys:
             raise ValueError("No OpenRouter API keys available. Please configure API keys.")
     
-    def _get_next_key(self) -> str:
-        """Get the next API key using round-robin rotation."""
-        with self._lock:
-            key = self.api_keys[self.current_key_index]
-            self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
-            return key
+    def _get_key_state(self, api_key: str) -> Dict[str, float]:
+        """Get the health record for an API key."""
+        return self._key_state.setdefault(api_key, {"cooldown_until": 0.0, "failures": 0})
+    
+    def _keys_by_health(self) -> List[str]:
+        """
+        Order the API keys to try for a request, healthiest first.
+        
+        Keys that aren't cooling down come first, fewest recent failures first and
+        shuffled within ties to spread load; keys still cooling down follow,
+        soonest available first.
+        
+        Returns:
+            List of API keys in the order they should be tried
+        """
+        now = time.monotonic()
+        healthy = [key for key in self.api_keys if self._get_key_state(key)["cooldown_until"] <= now]
+        cooling = [key for key in self.api_keys if self._get_key_state(key)["cooldown_until"] > now]
+        
+        random.shuffle(healthy)
+        # Sorting is stable, so keys with equal failure counts stay shuffled
+        healthy.sort(key=lambda key: self._get_key_state(key)["failures"])
+        cooling.sort(key=lambda key: self._get_key_state(key)["cooldown_until"])
+        return healthy + cooling
+    
+    def _mark_key_failed(self, api_key: str) -> None:
+        """Put a key that failed an HTTP request into an exponentially growing cooldown."""
+        state = self._get_key_state(api_key)
+        state["failures"] += 1
+        backoff = config.KEY_COOLDOWN_SECONDS * 2 ** (state["failures"] - 1)
+        state["cooldown_until"] = time.monotonic() + min(backoff, config.KEY_COOLDOWN_MAX_SECONDS)
+    
+    def _mark_key_succeeded(self, api_key: str) -> None:
+        """Clear a key's failure history after a successful request."""
+        state = self._get_key_state(api_key)
+        state["failures"] = 0
+        state["cooldown_until"] = 0.0
+    
+    def _build_headers(self, api_key: str) -> Dict[str, str]:
+        """Build the HTTP headers for an OpenRouter request."""
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}",
+            "HTTP-Referer": "https://sql-ai-chatbot.streamlit.app",  # Update when deployed
+            "X-Title": "SQLite AI Chatbot"
+        }
+    
+    def _build_payload(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> Dict[str, Any]:
+        """Build the JSON body for an OpenRouter chat completion request."""
+        return {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "response_format": {"type": "text"}  # Ensure plain text response
+        }
     
     def generate_response(
         self, 
@@ -52,67 +154,335 @@ class GeminiAPI:
             Generated response text or None if request failed
         """
         # Cancel any existing request
-        if hasattr(self._local, 'current_request') and self._local.current_request:
+        if self._cancel_event is not None and not self._cancel_event.is_set():
             print("Cancelling previous request...")
-            self._local.current_request = None
+            self.cancel_current_request()
+        
+        cancel_event = threading.Event()
+        self._cancel_event = cancel_event
         
         # Try all available keys if needed
         errors = []
+        body = _json_dumps(self._build_payload(messages, temperature, max_tokens))
+        keys = self._keys_by_health()
         
-        for attempt in range(len(self.api_keys)):
-            api_key = self._get_next_key()
-            
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_key}",
-                "HTTP-Referer": "https://sql-ai-chatbot.streamlit.app",  # Update when deployed
-                "X-Title": "SQLite AI Chatbot"
-            }
+        try:
+            for attempt in range(len(keys)):
+                if cancel_event.is_set():
+                    print("Request cancelled")
+                    return None
+                
+                api_key = keys[attempt]
+                
+                headers = self._build_headers(api_key)
+                
+                try:
+                    print(f"Sending request to Gemini model with API key #{attempt+1}")
+                    
+                    # Stream the body so a cancel can close the connection mid-read
+                    response = self._session.post(self.api_url, headers=headers, data=body, timeout=timeout, stream=True)
+                    with self._lock:
+                        self._active_response = response
+                    response.raise_for_status()  # Raise exception for HTTP errors
+                    
+                    response_body = self._read_body(response, cancel_event)
+                    if response_body is None:
+                        print("Request cancelled")
+                        return None
+                    
+                    response_data = _json_loads(response_body)
+                    
+                    if "choices" in response_data and len(response_data["choices"]) > 0:
+                        content = response_data["choices"][0]["message"]["content"]
+                        print(f"Response content length: {len(content)}")
+                        self._mark_key_succeeded(api_key)
+                        return content
+                    
+                    print("No content in response choices, trying next key")
+                    errors.append(f"No content in response (key #{attempt+1})")
+                    
+                except requests.exceptions.RequestException as e:
+                    error_msg = f"API request error with key #{attempt+1}: {str(e)}"
+                    print(error_msg)
+                    errors.append(error_msg)
+                    if not cancel_event.is_set():
+                        self._mark_key_failed(api_key)
+                    time.sleep(1)  # Brief pause before trying next key
+                except (KeyError, json.JSONDecodeError) as e:
+                    error_msg = f"API response parsing error with key #{attempt+1}: {str(e)}"
+                    print(error_msg)
+                    errors.append(error_msg)
+                finally:
+                    with self._lock:
+                        if self._active_response is not None:
+                            self._active_response.close()
+                            self._active_response = None
             
-            data = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "response_format": {"type": "text"}  # Ensure plain text response
-            }
+            # If we get here, all keys have failed
+            print(f"All API keys failed: {', '.join(errors)}")
+            return None
+        finally:
+            # Nothing left to cancel once this call returns
+            with self._lock:
+                if self._cancel_event is cancel_event:
+                    self._cancel_event = None
+    
+    async def agenerate_response(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: int = 2048,
+        timeout: int = 300,
+        cancel_event: Optional[asyncio.Event] = None
+    ) -> Optional[str]:
+        """
+        Asynchronously send a request to the Gemini model and get a response.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            temperature: Sampling temperature (0.0-1.0)
+            max_tokens: Maximum tokens to generate
+            timeout: Request timeout in seconds
+            cancel_event: Optional event that aborts the request when set
             
-            try:
-                session = requests.Session()
-                self._local.current_request = session
-                
-                print(f"Sending request to Gemini model with API key #{attempt+1}")
+        Returns:
+            Generated response text or None if request failed or was cancelled
+        """
+        body = _json_dumps(self._build_payload(messages, temperature, max_tokens))
+        
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            async def post(api_key: str, attempt: int) -> str:
+                print(f"Sending async request to Gemini model with API key #{attempt+1}")
                 
-                response = session.post(self.api_url, headers=headers, data=json.dumps(data), timeout=timeout)
+                response = await client.post(self.api_url, headers=self._build_headers(api_key), content=body)
                 response.raise_for_status()  # Raise exception for HTTP errors
                 
-                response_data = response.json()
+                response_data = _json_loads(response.content)
                 
                 if "choices" in response_data and len(response_data["choices"]) > 0:
                     content = response_data["choices"][0]["message"]["content"]
                     print(f"Response content length: {len(content)}")
                     return content
                 
-                print("No content in response choices, trying next key")
-                errors.append(f"No content in response (key #{attempt+1})")
+                raise ValueError("No content in response choices")
+            
+            return await self._race_keys(post, cancel_event)
+    
+    async def astream_response(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: int = 2048,
+        timeout: int = 300,
+        cancel_event: Optional[asyncio.Event] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream a response from the Gemini model as it is generated.
+        
+        The stream comes from whichever key produces content first; once content
+        has been yielded, errors end the stream instead of retrying another key.
+        
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            temperature: Sampling temperature (0.0-1.0)
+            max_tokens: Maximum tokens to generate
+            timeout: Request timeout in seconds
+            cancel_event: Optional event that aborts the request when set
+            
+        Yields:
+            Chunks of generated response text
+        """
+        payload = self._build_payload(messages, temperature, max_tokens)
+        payload["stream"] = True
+        body = _json_dumps(payload)
+        
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            async def open_stream(api_key: str, attempt: int):
+                print(f"Streaming request to Gemini model with API key #{attempt+1}")
                 
-            except requests.exceptions.RequestException as e:
+                request = client.build_request(
+                    "POST", self.api_url, headers=self._build_headers(api_key), content=body
+                )
+                response = await client.send(request, stream=True)
+                try:
+                    response.raise_for_status()  # Raise exception for HTTP errors
+                    chunks = self._iter_stream_content(response)
+                    try:
+                        first_chunk = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        raise ValueError("No content in streamed response")
+                except BaseException:
+                    await response.aclose()
+                    raise
+                return response, first_chunk, chunks
+            
+            async def close_stream(stream) -> None:
+                await stream[0].aclose()
+            
+            stream = await self._race_keys(open_stream, cancel_event, discard=close_stream)
+            if stream is None:
+                return
+            
+            response, first_chunk, chunks = stream
+            try:
+                yield first_chunk
+                async for content in chunks:
+                    if cancel_event is not None and cancel_event.is_set():
+                        print("Request cancelled")
+                        return
+                    yield content
+            except (httpx.HTTPError, KeyError, ValueError) as e:
+                print(f"Stream interrupted: {str(e)}")
+            finally:
+                await response.aclose()
+    
+    @staticmethod
+    async def _iter_stream_content(response: httpx.Response) -> AsyncIterator[str]:
+        """
+        Parse content chunks from an OpenRouter server-sent event stream.
+        
+        Args:
+            response: Streaming HTTP response
+            
+        Yields:
+            Non-empty chunks of generated text
+        """
+        async for line in response.aiter_lines():
+            # Server-sent events; other lines are keep-alive comments
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                return
+            
+            chunk = _json_loads(data)
+            if "error" in chunk:
+                raise ValueError(f"Error in stream: {chunk['error']}")
+            
+            choices = chunk.get("choices")
+            content = choices[0].get("delta", {}).get("content") if choices else None
+            if content:
+                yield content
+    
+    async def _race_keys(
+        self,
+        request_for_key: Callable[[str, int], Awaitable[Any]],
+        cancel_event: Optional[asyncio.Event] = None,
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None
+    ) -> Any:
+        """
+        Run a request with API key fallback, hedging across the first keys.
+        
+        The first HEDGED_REQUEST_KEYS keys are tried in parallel and the first
+        success wins; the others are cancelled. If they all fail, the remaining
+        keys are tried one at a time.
+        
+        Args:
+            request_for_key: Coroutine function taking (api_key, attempt index)
+                             that returns a result or raises on failure
+            cancel_event: Optional event that aborts the request when set
+            discard: Optional coroutine function releasing a result that lost the race
+            
+        Returns:
+            Result of the first successful request, or None if all keys failed
+            or the request was cancelled
+        """
+        errors = []
+        keys = self._keys_by_health()
+        hedged = keys[:config.HEDGED_REQUEST_KEYS]
+        
+        def record_error(attempt: int, e: Exception) -> None:
+            if isinstance(e, httpx.HTTPError):
                 error_msg = f"API request error with key #{attempt+1}: {str(e)}"
-                print(error_msg)
-                errors.append(error_msg)
-                time.sleep(1)  # Brief pause before trying next key
-            except (KeyError, json.JSONDecodeError) as e:
+                self._mark_key_failed(keys[attempt])
+            else:
                 error_msg = f"API response parsing error with key #{attempt+1}: {str(e)}"
-                print(error_msg)
-                errors.append(error_msg)
-            finally:
-                if hasattr(self._local, 'current_request'):
-                    self._local.current_request = None
+            print(error_msg)
+            errors.append(error_msg)
+        
+        tasks = {asyncio.ensure_future(request_for_key(key, i)): i for i, key in enumerate(hedged)}
+        cancel_wait = asyncio.ensure_future(cancel_event.wait()) if cancel_event is not None else None
+        pending = set(tasks)
+        winner = None
+        
+        try:
+            while pending and winner is None:
+                waiting = pending | {cancel_wait} if cancel_wait is not None else pending
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                
+                if cancel_wait is not None and cancel_wait in done:
+                    print("Request cancelled")
+                    return None
+                
+                for task in done:
+                    pending.discard(task)
+                    error = task.exception()
+                    if error is None and winner is None:
+                        winner = task.result()
+                        self._mark_key_succeeded(keys[tasks[task]])
+                    elif error is None:
+                        # Both finished at once; release the one we don't use
+                        if discard is not None:
+                            await discard(task.result())
+                    elif isinstance(error, (httpx.HTTPError, KeyError, ValueError)):
+                        record_error(tasks[task], error)
+                    else:
+                        raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            if cancel_wait is not None:
+                cancel_wait.cancel()
+        
+        if winner is not None:
+            return winner
+        
+        for attempt in range(len(hedged), len(keys)):
+            if cancel_event is not None and cancel_event.is_set():
+                print("Request cancelled")
+                return None
+            
+            await asyncio.sleep(1)  # Brief pause before trying next key
+            try:
+                result = await self._await_unless_cancelled(request_for_key(keys[attempt], attempt), cancel_event)
+                if result is None:
+                    print("Request cancelled")
+                else:
+                    self._mark_key_succeeded(keys[attempt])
+                return result
+            except (httpx.HTTPError, KeyError, ValueError) as e:
+                record_error(attempt, e)
         
         # If we get here, all keys have failed
         print(f"All API keys failed: {', '.join(errors)}")
         return None
     
+    @staticmethod
+    async def _await_unless_cancelled(coro, cancel_event: Optional[asyncio.Event]):
+        """
+        Await a coroutine, abandoning it if the cancel event fires first.
+        
+        Args:
+            coro: Coroutine to await
+            cancel_event: Optional event that aborts the wait when set
+            
+        Returns:
+            Result of the coroutine, or None if it was cancelled
+        """
+        if cancel_event is None:
+            return await coro
+        
+        task = asyncio.ensure_future(coro)
+        cancel_wait = asyncio.ensure_future(cancel_event.wait())
+        await asyncio.wait([task, cancel_wait], return_when=asyncio.FIRST_COMPLETED)
+        
+        if task.done():
+            cancel_wait.cancel()
+            return task.result()
+        
+        task.cancel()
+        return None
+    
     def extract_sql_from_response(self, response: str) -> str:
         """
         Extract SQL query from the LLM response.
@@ -123,47 +493,23 @@ class GeminiAPI:
         Returns:
             Extracted SQL query or empty string if not found
         """
-        # Look for SQL code blocks
-        if "```sql" in response:
-            parts = response.split("```sql")
-            if len(parts) > 1:
-                sql_parts = parts[1].split("```")
-                if sql_parts:
-                    return self._clean_sql_query(sql_parts[0].strip())
-        
-        # Look for generic code blocks that might contain SQL
-        if "```" in response:
-            parts = response.split("```")
-            if len(parts) > 1:
-                for i in range(1, len(parts), 2):  # Check odd-indexed parts (inside code blocks)
-                    if i < len(parts):
-                        potential_sql = parts[i].strip()
-                        # Check if it looks like SQL
-                        if re.search(r'SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP|PRAGMA', potential_sql, re.IGNORECASE):
-                            return self._clean_sql_query(potential_sql)
-        
-        # If no code blocks found, try to extract based on SQL keywords
-        sql_keywords = ["SELECT", "FROM", "WHERE", "GROUP BY", "ORDER BY", 
-                        "INSERT INTO", "UPDATE", "DELETE FROM", "PRAGMA"]
-        
-        lines = response.split('\n')
-        sql_lines = []
-        in_sql = False
-        
-        for line in lines:
-            line_upper = line.strip().upper()
-            
-            # Check if this line starts with SQL keywords
-            if any(line_upper.startswith(keyword) for keyword in sql_keywords):
-                in_sql = True
-                sql_lines.append(line)
-            elif in_sql and line.strip():
-                sql_lines.append(line)
-            elif in_sql and not line.strip():
-                in_sql = False
-        
-        if sql_lines:
-            return self._clean_sql_query('\n'.join(sql_lines).strip())
+        # Scan the code blocks once: the first ```sql block wins, otherwise
+        # the first generic block that looks like SQL
+        generic_sql = None
+        for match in _FENCE_RE.finditer(response):
+            body = match.group(2).strip()
+            if match.group(1):
+                return self._clean_sql_query(body)
+            if generic_sql is None and _SQL_KW_RE.search(body):
+                generic_sql = body
+        
+        if generic_sql is not None:
+            return self._clean_sql_query(generic_sql)
+        
+        # If no code blocks found, take the runs of lines starting with SQL keywords
+        sql_blocks = [match.group(0) for match in _SQL_BLOCK_RE.finditer(response)]
+        if sql_blocks:
+            return self._clean_sql_query('\n'.join(sql_blocks).strip())
         
         return ""
     
@@ -181,13 +527,13 @@ class GeminiAPI:
         # This prevents "You can only execute one statement at a time" errors
         
         # First, remove comments
-        query = re.sub(r'--.*$', '', query, flags=re.MULTILINE)
-        query = re.sub(r'/\*.*?\*/', '', query, flags=re.DOTALL)
+        query = _LINE_COMMENT_RE.sub('', query)
+        query = _BLOCK_COMMENT_RE.sub('', query)
         
         # Check if we have multiple PRAGMA statements
         if query.upper().count("PRAGMA") > 1:
             # For PRAGMA queries, keep only the first one
-            pragma_parts = re.split(r'(PRAGMA\s+[^;]+;)', query, flags=re.IGNORECASE)
+            pragma_parts = _PRAGMA_SPLIT_RE.split(query)
             non_empty_parts = [p for p in pragma_parts if p.strip()]
             if non_empty_parts:
                 return non_empty_parts[0].strip()
@@ -200,8 +546,40 @@ class GeminiAPI:
         
         return query
     
+    @staticmethod
+    def _read_body(response: requests.Response, cancel_event: threading.Event) -> Optional[bytes]:
+        """
+        Read a streamed response body, stopping early if the request is cancelled.
+        
+        Args:
+            response: Response opened with stream=True
+            cancel_event: Event set when the request is cancelled
+            
+        Returns:
+            Response body, or None if the request was cancelled
+        """
+        chunks = []
+        try:
+            for chunk in response.iter_content(chunk_size=8192):
+                if cancel_event.is_set():
+                    return None
+                chunks.append(chunk)
+        except Exception:
+            # Closing the response from another thread aborts the read
+            if cancel_event.is_set():
+                return None
+            raise
+        return b"".join(chunks)
+    
     def cancel_current_request(self):
         """Cancel the current API request if one is in progress."""
-        if hasattr(self._local, 'current_request') and self._local.current_request:
-            self._local.current_request = None
+        with self._lock:
+            cancel_event, response = self._cancel_event, self._active_response
+            self._active_response = None
+        
+        if cancel_event is not None and not cancel_event.is_set():
+            cancel_event.set()
+            # Closing the connection unblocks a thread waiting on the response body
+            if response is not None:
+                response.close()
             print("Manually cancelled current request")
\ No newline at end of file
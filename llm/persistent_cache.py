@@ -0,0 +1,87 @@
+"""
+SQLite-backed persistent storage for LLM responses.
+"""
+import os
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentCache:
+    """Stores LLM response text in a local SQLite file so it survives restarts."""
+
+    def __init__(self, db_path: str, max_age: Optional[float] = None):
+        """
+        Initialize the persistent cache.
+
+        Args:
+            db_path: Path to the SQLite cache file (created if missing)
+            max_age: Maximum entry age in seconds; older entries are evicted on startup
+        """
+        self.db_path = db_path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        # WAL so lookups from other sessions or processes don't block on writes
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "prompt_hash BLOB PRIMARY KEY, response TEXT NOT NULL, created_at INTEGER NOT NULL)"
+        )
+
+        if max_age is not None:
+            threading.Thread(target=self._evict_expired, name="response-cache-eviction", daemon=True).start()
+
+    def _evict_expired(self) -> None:
+        """Delete entries older than max_age."""
+        cutoff = int(time.time() - self.max_age)
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,))
+        except sqlite3.Error as e:
+            logger.warning("Response cache eviction error: %s", e)
+
+    def get(self, prompt_hash: bytes) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            prompt_hash: Cache key for the prompt
+
+        Returns:
+            Cached response text or None if not found
+        """
+        try:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE prompt_hash = ?", (prompt_hash,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Response cache read error: %s", e)
+            return None
+        return row[0] if row else None
+
+    def put(self, prompt_hash: bytes, response: str) -> None:
+        """
+        Store a response.
+
+        Args:
+            prompt_hash: Cache key for the prompt
+            response: LLM response text
+        """
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (prompt_hash, response, created_at) VALUES (?, ?, ?)",
+                    (prompt_hash, response, int(time.time()))
+                )
+        except sqlite3.Error as e:
+            logger.warning("Response cache write error: %s", e)
@@ -1,9 +1,17 @@
 """
 Constructs effective prompts for the LLM that include schema context.
 """
+import sys
 from typing import List, Dict, Any
 import config
 
+# Message keys and roles shared by every message dict
+_KEY_ROLE = sys.intern("role")
+_KEY_CONTENT = sys.intern("content")
+_ROLE_SYSTEM = sys.intern("system")
+_ROLE_USER = sys.intern("user")
+_ROLE_ASSISTANT = sys.intern("assistant")
+
 class PromptBuilder:
     """Builds prompts for the LLM that include database schema information."""
     
@@ -15,15 +23,17 @@ class PromptBuilder:
             schema: Formatted database schema information
         """
         self.schema = schema
+        # The schema never changes for a builder, so build the system message once
+        self._system_message = {_KEY_ROLE: _ROLE_SYSTEM, _KEY_CONTENT: self._format_system_prompt()}
     
-    def build_system_message(self) -> Dict[str, str]:
+    def _format_system_prompt(self) -> str:
         """
-        Create the system message with instructions and schema information.
+        Format the system prompt with instructions and schema information.
         
         Returns:
-            Dictionary with role and content for the system message
+            System prompt text
         """
-        system_content = f"""You are a specialized SQL assistant that helps users interact with a SQLite database. Your task is to convert natural language questions into correct SQL queries.
+        return f"""You are a specialized SQL assistant that helps users interact with a SQLite database. Your task is to convert natural language questions into correct SQL queries.
 
 DATABASE SCHEMA:
 {self.schema}
@@ -43,7 +53,15 @@ SELECT column_name FROM table_name WHERE condition;
 
 This query [explanation of what the query does]. It uses [mention any important SQL concepts].
 """
-        return {"role": "system", "content": system_content}
+    
+    def build_system_message(self) -> Dict[str, str]:
+        """
+        Create the system message with instructions and schema information.
+        
+        Returns:
+            Dictionary with role and content for the system message (shared, do not modify)
+        """
+        return self._system_message
     
     def build_user_message(self, query: str) -> Dict[str, str]:
         """
@@ -55,7 +73,7 @@ This query [explanation of what the query does]. It uses [mention any important
         Returns:
             Dictionary with role and content for the user message
         """
-        return {"role": "user", "content": query}
+        return {_KEY_ROLE: _ROLE_USER, _KEY_CONTENT: query}
     
     def build_assistant_message(self, content: str) -> Dict[str, str]:
         """
@@ -67,7 +85,7 @@ This query [explanation of what the query does]. It uses [mention any important
         Returns:
             Dictionary with role and content for the assistant message
         """
-        return {"role": "assistant", "content": content}
+        return {_KEY_ROLE: _ROLE_ASSISTANT, _KEY_CONTENT: content}
     
     def build_messages(self, query: str, conversation_history: List[Dict[str, str]] = None) -> List[Dict[str, str]]:
         """
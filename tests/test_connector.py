@@ -0,0 +1,43 @@
+"""
+Tests for the database connector.
+"""
+import os
+import tempfile
+import unittest
+
+from database import DatabaseConnector
+
+
+class TransactionTest(unittest.TestCase):
+    """Tests for DatabaseConnector.transaction."""
+    
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.connector = DatabaseConnector(os.path.join(temp_dir.name, "test.db"))
+        self.addCleanup(self.connector.disconnect)
+        self.connector.execute_query("CREATE TABLE t (id INTEGER PRIMARY KEY, value INTEGER)")
+        self.connector.execute_query("INSERT INTO t (id, value) VALUES (1, 0)")
+    
+    def _value(self):
+        return int(self.connector.execute_query("SELECT value FROM t WHERE id = 1").df["value"].iloc[0])
+    
+    def test_commits_when_block_succeeds(self):
+        with self.connector.transaction():
+            self.connector.execute_query("UPDATE t SET value = 1 WHERE id = 1")
+        
+        self.assertEqual(self._value(), 1)
+        self.assertFalse(self.connector.conn.in_transaction)
+    
+    def test_rolls_back_when_block_raises(self):
+        with self.assertRaises(RuntimeError):
+            with self.connector.transaction():
+                self.connector.execute_query("UPDATE t SET value = 1 WHERE id = 1")
+                raise RuntimeError("batch failed")
+        
+        self.assertEqual(self._value(), 0)
+        self.assertFalse(self.connector.conn.in_transaction)
+
+
+if __name__ == "__main__":
+    unittest.main()
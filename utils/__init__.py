@@ -2,6 +2,10 @@
 Utilities module initialization.
 """
 from .query_processor import QueryProcessor
-from .formatter import ResponseFormatter
+from .formatter import ResponseFormatter, format_query_results, parse_llm_response
+from .intent import answer_metadata_query
 
-__all__ = ["QueryProcessor", "ResponseFormatter"]
\ No newline at end of file
+__all__ = [
+    "QueryProcessor", "ResponseFormatter", "format_query_results", "parse_llm_response",
+    "answer_metadata_query"
+]
\ No newline at end of file
@@ -1,112 +1,164 @@
 """
 Formatting utilities for query results and responses.
 """
+import numpy as np
 import pandas as pd
 import re
 from typing import Dict, Any, Tuple
+from config import MAX_RESULT_ROWS
 
-class ResponseFormatter:
-    """Formats query results and LLM responses for display."""
+# Fenced code blocks with their language tag (an unterminated final block runs to the end)
+_FENCE_RE = re.compile(r'```(\w*)(.*?)(?:```|\Z)', re.DOTALL)
+# An educational section marker
+_EDU_RE = re.compile(r'SQL Concept:|Educational Note:|Note:|SQL Tip:')
+
+
+def format_query_results(results: Dict[str, Any]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Format query execution results for display.
     
-    @staticmethod
-    def format_query_results(results: Dict[str, Any]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
-        """
-        Format query execution results for display.
-        
-        Args:
-            results: Dictionary containing query results, error, and execution time
-            
-        Returns:
-            Tuple containing:
-            - Formatted DataFrame for display
-            - Metadata dictionary with error and execution time
-        """
-        df = results["results"]
-        metadata = {
-            "error": results["error"],
-            "execution_time": f"{results['execution_time']:.4f} seconds"
-        }
+    Args:
+        results: Dictionary containing query results, error, and execution time
         
-        # If there's no data, return an empty DataFrame with metadata
-        if df.empty:
-            return df, metadata
-        
-        # Format the DataFrame for display
-        # This includes handling large text fields and numeric formatting
-        formatted_df = df.copy()
-        
-        for col in formatted_df.columns:
-            # Format numeric columns
-            if pd.api.types.is_numeric_dtype(formatted_df[col]):
-                # For integer-like columns, don't show decimals
-                if formatted_df[col].dropna().apply(lambda x: x == int(x)).all():
-                    formatted_df[col] = formatted_df[col].map(lambda x: int(x) if pd.notnull(x) else x)
-            
-            # Truncate large text fields
-            if pd.api.types.is_string_dtype(formatted_df[col]):
-                formatted_df[col] = formatted_df[col].apply(
-                    lambda x: f"{x[:100]}..." if isinstance(x, str) and len(x) > 100 else x
-                )
-        
-        return formatted_df, metadata
+    Returns:
+        Tuple containing:
+        - Formatted DataFrame for display, at most MAX_RESULT_ROWS rows (the
+          input DataFrame itself if it is within the cap and no column needed
+          reformatting)
+        - Metadata dictionary with error, execution_time_s (execution time
+          in seconds as a float, left for the UI to format) and total_rows
+          (row count before the display was cut to MAX_RESULT_ROWS rows)
+    """
+    df = results["results"]
+    metadata = {
+        "error": results["error"],
+        "execution_time_s": float(results["execution_time"]),
+        "total_rows": len(df)
+    }
     
-    @staticmethod
-    def parse_llm_response(response: str) -> Dict[str, str]:
-        """
-        Parse and structure the LLM response.
-        
-        Args:
-            response: Raw LLM response text
-            
-        Returns:
-            Dictionary containing:
-            - sql_query: Extracted SQL query
-            - explanation: Explanation part of the response
-            - educational_notes: Educational notes (if any)
-        """
-        # Initialize result structure
-        result = {
-            "sql_query": "",
-            "explanation": "",
-            "educational_notes": ""
-        }
-        
-        # Extract SQL query from code blocks
-        sql_matches = re.findall(r'```sql\s+(.*?)\s+```', response, re.DOTALL)
-        if sql_matches:
-            result["sql_query"] = sql_matches[0].strip()
-        else:
-            # Try to find generic code blocks that might contain SQL
-            code_matches = re.findall(r'```\s+(.*?)\s+```', response, re.DOTALL)
-            if code_matches:
-                result["sql_query"] = code_matches[0].strip()
-        
-        # Extract explanation (text before the SQL block)
-        if "```" in response:
-            explanation_part = response.split("```")[0].strip()
-            result["explanation"] = explanation_part
-        
-        # Extract educational notes (typically after the SQL block)
-        educational_patterns = [
-            r'SQL Concept:',
-            r'Educational Note:',
-            r'Note:',
-            r'SQL Tip:'
-        ]
-        
-        for pattern in educational_patterns:
-            if pattern in response:
-                parts = response.split(pattern)
-                if len(parts) > 1:
-                    result["educational_notes"] = pattern + parts[1].strip()
-                    break
-        
-        # If no specific educational section was found, check for text after the SQL block
-        if not result["educational_notes"] and "```" in response:
-            parts = response.split("```")
-            if len(parts) > 2:
-                after_sql = parts[2].strip()
-                if after_sql:
-                    result["educational_notes"] = after_sql
+    # If there's no data, return an empty DataFrame with metadata
+    if df.empty:
+        return df, metadata
+    
+    # Only the displayed rows are formatted, however large the result is
+    if len(df) > MAX_RESULT_ROWS:
+        df = df.iloc[:MAX_RESULT_ROWS]
+    
+    # Format the DataFrame for display
+    # This includes handling large text fields and numeric formatting.
+    # Only the reformatted columns are collected; the rest are passed through
+    modified = {}
+    
+    # Columns sharing a name can't be replaced by name, so they are shown as they are
+    candidates = df.loc[:, ~df.columns.duplicated(keep=False)] if df.columns.has_duplicates else df
+    
+    # Format numeric columns. Integer columns already show no decimals, so
+    # only float columns are scanned
+    for col, series in candidates.select_dtypes(include="floating").items():
+        # For integer-like columns, don't show decimals. Values outside the
+        # int64 range are left as they are
+        values = series.dropna().to_numpy()
+        if values.size and (np.abs(values) < 2.0 ** 63).all() and (values % 1 == 0).all():
+            modified[col] = pd.to_numeric(series.astype("Int64"), downcast="integer")
+    
+    # Store integer columns in the smallest integer type that holds their values,
+    # shrinking the frame the UI serializes. Floats keep their precision
+    for col, series in candidates.select_dtypes(include="integer").items():
+        downcast = pd.to_numeric(series, downcast="integer")
+        if downcast.dtype != series.dtype:
+            modified[col] = downcast
+    
+    # Truncate large text fields. Object columns can hold any values, so they
+    # are only truncated if they hold strings
+    for col, series in candidates.select_dtypes(include=["object", "string"]).items():
+        if not pd.api.types.is_string_dtype(series):
+            continue
+        # Missing values have no length and are never truncated
+        mask = series.str.len() > 100
+        if mask.any():
+            modified[col] = series.where(~mask, series.str.slice(0, 100) + "...")
+    
+    if not modified:
+        return df, metadata
+    
+    # Assigned one by one: column names need not be valid keyword arguments
+    out = df.copy(deep=False)
+    for col, series in modified.items():
+        out[col] = series
+    return out, metadata
+
+
+def parse_llm_response(response: str) -> Dict[str, str]:
+    """
+    Parse and structure the LLM response.
+    
+    Args:
+        response: Raw LLM response text
         
-        return result
\ No newline at end of file
+    Returns:
+        Dictionary containing:
+        - sql_query: Extracted SQL query
+        - explanation: Explanation part of the response
+        - educational_notes: Educational notes (if any)
+    """
+    # Initialize result structure
+    result = {
+        "sql_query": "",
+        "explanation": "",
+        "educational_notes": ""
+    }
+    
+    # Find the code blocks in one pass, stopping once the first two blocks and a
+    # ```sql block have been seen; the text around them is sliced by position
+    first_block = second_block = sql_block = generic_block = None
+    for block in _FENCE_RE.finditer(response):
+        if first_block is None:
+            first_block = block
+        elif second_block is None:
+            second_block = block
+        tag = block.group(1)
+        if tag == "sql":
+            if sql_block is None:
+                sql_block = block
+        elif not tag and generic_block is None:
+            generic_block = block
+        if sql_block is not None and second_block is not None:
+            break
+    
+    # Extract SQL query from the first ```sql block, otherwise the first untagged block
+    if sql_block is None:
+        sql_block = generic_block
+    if sql_block is not None:
+        result["sql_query"] = sql_block.group(2).strip()
+    
+    # Extract explanation (text before the SQL block)
+    if first_block is not None:
+        result["explanation"] = response[:first_block.start()].strip()
+    
+    # Extract educational notes (typically after the SQL block). The text after the
+    # first block is searched first and the text before it only if that fails, so
+    # each character is scanned once. The notes run to the end of the response
+    if first_block is None:
+        edu_match = _EDU_RE.search(response)
+    else:
+        edu_match = (
+            _EDU_RE.search(response, first_block.end())
+            or _EDU_RE.search(response, 0, first_block.end())
+        )
+    if edu_match:
+        result["educational_notes"] = edu_match.group(0) + response[edu_match.end():].strip()
+    
+    # If no specific educational section was found, use the text after the first code block
+    if not result["educational_notes"] and first_block is not None:
+        after_end = second_block.start() if second_block is not None else len(response)
+        result["educational_notes"] = response[first_block.end():after_end].strip()
+    
+    return result
+
+
+class ResponseFormatter:
+    """Formats query results and LLM responses for display."""
+    
+    # Kept for callers that use the class; the module-level functions avoid the method lookup
+    format_query_results = staticmethod(format_query_results)
+    parse_llm_response = staticmethod(parse_llm_response)
\ No newline at end of file
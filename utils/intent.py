@@ -0,0 +1,87 @@
+"""
+Direct answers for common schema questions that don't need the LLM.
+"""
+import re
+import pandas as pd
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from database.connector import DatabaseConnector
+
+_LEAD = r'^\s*(?:please\s+)?(?:list|show|display|what\s+are)(?:\s+me)?(?:\s+all)?(?:\s+(?:of\s+)?the)?\s+'
+_TAIL = r'\s*[?.!]*\s*$'
+
+# Handlers take the connector and regex match, and return (explanation, SQL, results)
+# or None to fall back to the LLM
+IntentHandler = Callable[[DatabaseConnector, re.Match], Optional[Tuple[str, str, pd.DataFrame]]]
+
+
+def _list_tables(db_connector: DatabaseConnector, match: re.Match) -> Tuple[str, str, pd.DataFrame]:
+    """Answer a request for the tables in the database."""
+    tables = db_connector.get_table_names()
+    sql = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';"
+    return "These are the tables in the database.", sql, pd.DataFrame({"name": tables})
+
+
+def _list_columns(db_connector: DatabaseConnector, match: re.Match) -> Optional[Tuple[str, str, pd.DataFrame]]:
+    """Answer a request for the columns of one table."""
+    requested = match.group(1).lower()
+    table = next((t for t in db_connector.get_table_names() if t.lower() == requested), None)
+    if table is None:
+        return None
+
+    columns = db_connector.get_table_info(table)
+    sql = "PRAGMA table_info(\"" + table.replace('"', '""') + "\");"
+    results = pd.DataFrame(
+        [(c["name"], c["type"], bool(c["notnull"]), c["default_value"], c["is_primary_key"]) for c in columns],
+        columns=["name", "type", "notnull", "default_value", "primary_key"]
+    )
+    return f"These are the columns of the {table} table.", sql, results
+
+
+INTENTS: List[Tuple[re.Pattern, IntentHandler]] = [
+    (re.compile(_LEAD + r'tables(?:\s+(?:in|of)\s+(?:the|this)\s+database)?' + _TAIL, re.IGNORECASE), _list_tables),
+    (
+        re.compile(
+            _LEAD + r'(?:fields|columns)\s+(?:in|of|from)(?:\s+the)?\s+(\w+)(?:\s+table)?' + _TAIL,
+            re.IGNORECASE
+        ),
+        _list_columns
+    ),
+]
+
+
+def answer_metadata_query(query: str, db_connector: DatabaseConnector) -> Optional[Dict[str, Any]]:
+    """
+    Answer a schema question such as "list all tables" directly from the database.
+
+    Args:
+        query: User's natural language query
+        db_connector: Database connector instance
+
+    Returns:
+        Response data in the same shape as an answered LLM query (LLM response,
+        parsed response, SQL and results), or None if the query needs the LLM
+    """
+    for pattern, handler in INTENTS:
+        match = pattern.match(query)
+        if not match:
+            continue
+
+        answer = handler(db_connector, match)
+        if answer is None:
+            return None
+
+        explanation, sql_query, results = answer
+        return {
+            # Written like an LLM answer so it reads naturally in later conversation context
+            "llm_response": f"{explanation}\n\n```sql\n{sql_query}\n```",
+            "parsed_response": {
+                "sql_query": sql_query,
+                "explanation": explanation,
+                "educational_notes": ""
+            },
+            "sql_query": sql_query,
+            "query_results": results,
+            "results_truncated": False
+        }
+
+    return None
@@ -3,9 +3,46 @@ SQL validation and execution utilities.
 """
 import re
 import pandas as pd
-from typing import Dict, Tuple, Optional
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Tuple, Optional
 from database.connector import DatabaseConnector
 
+# Patterns used to normalize and check queries, compiled once
+_LINE_COMMENT_RE = re.compile(r'--.*$', re.MULTILINE)
+_BLOCK_COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+_READ_RE = re.compile(r'^(?:SELECT|WITH|PRAGMA|EXPLAIN)\b', re.IGNORECASE)
+_READ_KEYWORDS = ("SELECT", "WITH", "PRAGMA", "EXPLAIN")
+# Operations validate_query rejects, matched against the upper-cased query
+_DANGEROUS_RE = re.compile(r';\s*DROP\s+TABLE|UNION\s+SELECT|INTO\s+(?:OUT|DUMP)FILE')
+
+# Validation results kept per processor before evicting the least recently used
+_VALIDATE_CACHE_MAX_ENTRIES = 256
+
+
+@lru_cache(maxsize=256)
+def _is_read_query(query: str) -> bool:
+    """Check if a query starts with a read-only keyword once comments are removed."""
+    # Without a leading comment the first word decides, so compare it directly
+    stripped = query.lstrip()
+    if not stripped.startswith(("--", "/*")):
+        head = stripped[:8].upper()
+        for keyword in _READ_KEYWORDS:
+            if head.startswith(keyword):
+                # The keyword must end at a word boundary, as \b requires in _READ_RE
+                following = head[len(keyword):len(keyword) + 1]
+                return not (following.isalnum() or following == "_")
+        return False
+    
+    # Normalize query: remove comments and extra whitespace
+    query = _LINE_COMMENT_RE.sub('', query)
+    query = _BLOCK_COMMENT_RE.sub('', query)
+    query = query.strip()
+    
+    # Check if the query starts with read-only keywords
+    return bool(_READ_RE.match(query))
+
+
 class QueryProcessor:
     """Processes, validates, and executes SQL queries."""
     
@@ -17,6 +54,8 @@ class QueryProcessor:
             db_connector: Database connector instance
         """
         self.db_connector = db_connector
+        # Validation results keyed by database file signature and query text
+        self._validate_cache: "OrderedDict[Tuple, Tuple[bool, Optional[str]]]" = OrderedDict()
     
     def is_read_query(self, query: str) -> bool:
         """
@@ -28,24 +67,7 @@ class QueryProcessor:
         Returns:
             True if the query is read-only, False otherwise
         """
-        # Normalize query: remove comments and extra whitespace
-        query = re.sub(r'--.*$', '', query, flags=re.MULTILINE)
-        query = re.sub(r'/\*.*?\*/', '', query, flags=re.DOTALL)
-        query = query.strip()
-        
-        # Check if the query starts with read-only keywords
-        read_patterns = [
-            r'^SELECT\b',
-            r'^WITH\b',
-            r'^PRAGMA\b',
-            r'^EXPLAIN\b'
-        ]
-        
-        for pattern in read_patterns:
-            if re.match(pattern, query, re.IGNORECASE):
-                return True
-        
-        return False
+        return _is_read_query(query)
     
     def validate_query(self, query: str) -> Tuple[bool, Optional[str]]:
         """
@@ -63,33 +85,47 @@ class QueryProcessor:
         # We're removing the read-only restriction to accommodate all types of queries
         
         # Basic SQL injection protection
-        dangerous_patterns = [
-            r';\s*DROP\s+TABLE',
-            r'UNION\s+SELECT',
-            r'INTO\s+OUTFILE',
-            r'INTO\s+DUMPFILE'
-        ]
+        if _DANGEROUS_RE.search(query.upper()):
+            return False, "Query contains potentially harmful operations"
         
-        for pattern in dangerous_patterns:
-            if re.search(pattern, query, re.IGNORECASE):
-                return False, "Query contains potentially harmful operations"
+        # Reuse the result for a query already validated against the unchanged database
+        cache_key = (self.db_connector.file_signature(), query)
+        cached = self._validate_cache.get(cache_key)
+        if cached is not None:
+            self._validate_cache.move_to_end(cache_key)
+            return cached
+        
+        result = self._validate_with_sqlite(query)
+        self._validate_cache[cache_key] = result
+        if len(self._validate_cache) > _VALIDATE_CACHE_MAX_ENTRIES:
+            self._validate_cache.popitem(last=False)
+        return result
+    
+    def _validate_with_sqlite(self, query: str) -> Tuple[bool, Optional[str]]:
+        """
+        Validate an SQL query by having SQLite compile it.
         
+        Args:
+            query: SQL query to validate
+            
+        Returns:
+            Tuple of whether the query is valid and the error message if not
+        """
         # Try to validate the query using SQLite's own validation
         try:
-            # Create an execution plan without running the query
-            # This will raise an error if the query is invalid
-            self.db_connector.conn.cursor().execute(f"EXPLAIN QUERY PLAN {query}")
+            # Compile the query to SQLite bytecode without running it, which skips the
+            # plan summary EXPLAIN QUERY PLAN builds. This will raise an error if the
+            # query is invalid
+            cursor = self.db_connector.conn.cursor()
+            try:
+                cursor.execute("EXPLAIN " + query)
+            finally:
+                cursor.close()
             return True, None
         except Exception as e:
-            # If the EXPLAIN fails, the query might still be valid (for non-SELECT queries)
-            # Let's try to validate it differently
-            try:
-                # Use SQLite's prepare feature to validate without executing
-                self.db_connector.conn.cursor().execute(f"PRAGMA table_info({query})")
-                return True, None
-            except Exception:
-                # If both validation methods fail, the query is likely invalid
-                return False, str(e)
+            # SQLite's parser accepts every statement kind after EXPLAIN, so a
+            # failure here means the query itself is invalid
+            return False, str(e)
     
     def execute_query(self, query: str) -> Dict:
         """
@@ -103,13 +139,32 @@ class QueryProcessor:
             - results: DataFrame with query results
             - error: Error message if execution failed
             - execution_time: Query execution time in seconds
+            - truncated: Whether the results were capped at MAX_RESULT_ROWS
         """
         # Execute the query directly without validation for now
         # We're bypassing strict validation to allow all types of queries
-        results, error, execution_time = self.db_connector.execute_query(query)
+        result = self.db_connector.execute_query(query)
         
         return {
-            "results": results,
-            "error": error,
-            "execution_time": execution_time
-        }
\ No newline at end of file
+            "results": result.df,
+            "error": result.error,
+            "execution_time": result.elapsed,
+            "truncated": result.truncated
+        }
+    
+    def execute_batch(self, queries: List[str]) -> List[Dict]:
+        """
+        Execute several SQL queries in a single transaction.
+        
+        The transaction begins and commits once for the whole batch rather than
+        once per query. A failing query reports its error in its own result and
+        the rest of the batch still runs.
+        
+        Args:
+            queries: SQL queries to execute, in order
+            
+        Returns:
+            List with one dictionary per query, as returned by execute_query
+        """
+        with self.db_connector.transaction():
+            return [self.execute_query(query) for query in queries]
\ No newline at end of file